@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+import itertools
+from pathlib import Path
+from functools import wraps
+import numpy as np
+
+"""
+End-to-end benchmark of the survey pipeline. Runs main.main on each config against
+a local MockLLMServer for a grid of subsample and batch_size settings, one subprocess
+per case so peak RSS is measured per case. Results are written as JSON to
+benchmarks/results/ for comparison across commits.
+
+usage: python benchmarks/bench_pipeline.py [--configs configs/Chicago configs/Lyon]
+       [--subsample 10 50] [--batch-size 5 25] [--schedule agent lockstep] [--latency 0.05]
+"""
+
+BENCH_DIR = Path(__file__).resolve().parent
+PACKAGE_DIR = BENCH_DIR.parent
+sys.path.insert(0, str(PACKAGE_DIR))
+
+
+def _prepare_config(config_folder: Path, work_dir: Path, subsample: int, batch_size: int, schedule: str, mock_conf: dict) -> Path:
+    """
+    Writes a copy of config_folder pointed at the mock LLM, linking every other entry
+    (templates, data, questions) back to the original.
+    """
+    bench_config = work_dir / config_folder.name
+    bench_config.mkdir(parents=True)
+    for entry in config_folder.iterdir():
+        if entry.name != "config.json":
+            os.symlink(entry.resolve(), bench_config / entry.name)
+
+    with open(config_folder / "config.json", "r") as f:
+        config = json.load(f)
+
+    config["model"] = {
+        "chat_model": "mock",
+        "chat_context_length": config["model"].get("chat_context_length", 16000),
+        "temperature": config["model"].get("temperature", 0.5),
+        "mock": mock_conf}
+    config["synthesis"]["subsample"] = subsample
+    config["synthesis"]["batch_size"] = batch_size
+    config["synthesis"]["schedule"] = schedule
+    config["synthesis"]["response_cache"] = None
+
+    with open(bench_config / "config.json", "w") as f:
+        json.dump(config, f, indent=4)
+    return bench_config
+
+
+def _timed(timings: list, fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            timings.append(time.perf_counter() - start)
+    return wrapper
+
+
+def _timed_async(timings: list, fn):
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            timings.append(time.perf_counter() - start)
+    return wrapper
+
+
+def run_case(config_folder: str, subsample: int, batch_size: int, schedule: str, mock_conf: dict) -> dict:
+    """
+    Runs one benchmark case in this process and returns its metrics
+    """
+    import main
+    from survey import SurveyEngine
+    from synthesize import SurveyAgent
+    from postprocess import ProcessSurveyResponse
+
+    timings = {"build_agents": [], "survey": [], "serialize": [], "question": []}
+    counts = {"agents": 0, "questions": 0}
+
+    main.build_agents = _timed(timings["build_agents"], main.build_agents)
+    SurveyEngine.run = _timed(timings["survey"], SurveyEngine.run)
+    SurveyAgent.ask_question = _timed(timings["question"], SurveyAgent.ask_question)
+    SurveyAgent.ask_question_async = _timed_async(timings["question"], SurveyAgent.ask_question_async)
+
+    serialize_response = ProcessSurveyResponse.serialize_response
+    def counted_serialize(self, agent_response):
+        counts["agents"] += 1
+        counts["questions"] += len(agent_response.logic_flow)
+        return serialize_response(self, agent_response)
+    ProcessSurveyResponse.serialize_response = _timed(timings["serialize"], counted_serialize)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        bench_config = _prepare_config(Path(config_folder), work_dir, subsample, batch_size, schedule, mock_conf)
+        start = time.perf_counter()
+        main.main(str(bench_config), str(work_dir / "run"))
+        wall_time = time.perf_counter() - start
+
+    survey_time = sum(timings["survey"])
+    question_latency = np.array(timings["question"]) if timings["question"] else np.zeros(1)
+    return {
+        "config": Path(config_folder).name,
+        "subsample": subsample,
+        "batch_size": batch_size,
+        "schedule": schedule,
+        "agents": counts["agents"],
+        "questions": counts["questions"],
+        "wall_time_s": wall_time,
+        "agents_per_s": counts["agents"] / survey_time if survey_time else 0.0,
+        "questions_per_s": counts["questions"] / survey_time if survey_time else 0.0,
+        "question_latency_p50_s": float(np.percentile(question_latency, 50)),
+        "question_latency_p95_s": float(np.percentile(question_latency, 95)),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "build_agents_s": sum(timings["build_agents"]),
+        "survey_engine_run_s": survey_time,
+        "serialize_response_s": sum(timings["serialize"])}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=PACKAGE_DIR, text=True).strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return "unknown"
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the survey pipeline against a mock LLM")
+    parser.add_argument("--configs", nargs="+", default=["configs/Chicago", "configs/Lyon"])
+    parser.add_argument("--subsample", nargs="+", type=int, default=[10, 50])
+    parser.add_argument("--batch-size", nargs="+", type=int, default=[5, 25])
+    parser.add_argument("--schedule", nargs="+", default=["agent"], choices=["agent", "lockstep"])
+    parser.add_argument("--latency", type=float, default=0.05, help="mean mock LLM latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.05)
+    parser.add_argument("--endpoints", type=int, default=1, help="number of mock LLM servers in the endpoint pool")
+    parser.add_argument("--output", default=None, help="results file, defaults to benchmarks/results/<timestamp>_<commit>.json")
+    parser.add_argument("--case", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_args()
+    mock_conf = {
+        "latency": args.latency,
+        "latency_jitter": 0.5,
+        "error_rate": args.error_rate,
+        "malformed_rate": args.malformed_rate,
+        "n_endpoints": args.endpoints}
+
+    # worker mode: run a single case and print its metrics
+    if args.case is not None:
+        config_folder, subsample, batch_size, schedule = json.loads(args.case)
+        os.chdir(PACKAGE_DIR)
+        result = run_case(config_folder, subsample, batch_size, schedule, mock_conf)
+        print("BENCH_RESULT " + json.dumps(result))
+        return
+
+    cases = []
+    for config_folder, subsample, batch_size, schedule in itertools.product(args.configs, args.subsample, args.batch_size, args.schedule):
+        case = json.dumps([config_folder, subsample, batch_size, schedule])
+        proc = subprocess.run(
+            [sys.executable, __file__, "--case", case,
+             "--latency", str(args.latency),
+             "--error-rate", str(args.error_rate),
+             "--malformed-rate", str(args.malformed_rate),
+             "--endpoints", str(args.endpoints)],
+            cwd=PACKAGE_DIR, capture_output=True, text=True)
+        lines = [line for line in proc.stdout.splitlines() if line.startswith("BENCH_RESULT ")]
+        if proc.returncode != 0 or not lines:
+            print(f"case {case} failed:\n{proc.stderr[-2000:]}")
+            continue
+        result = json.loads(lines[-1].split(" ", 1)[1])
+        cases.append(result)
+        print(
+            f"{result['config']:>8} n={subsample:<5} batch={batch_size:<4} {schedule:>8} "
+            f"{result['agents_per_s']:8.2f} agents/s {result['questions_per_s']:8.2f} q/s "
+            f"p50 {result['question_latency_p50_s']:.3f}s p95 {result['question_latency_p95_s']:.3f}s "
+            f"rss {result['peak_rss_mb']:.0f}MB")
+
+    commit = _git_commit()
+    output = Path(args.output) if args.output else BENCH_DIR / "results" / f"{time.strftime('%Y%m%d_%H%M%S')}_{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "mock": mock_conf,
+            "cases": cases}, f, indent=4)
+    print(f"Results written to: {output}")
+
+
+if __name__ == "__main__":
+    main()
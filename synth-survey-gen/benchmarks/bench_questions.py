@@ -0,0 +1,194 @@
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+"""
+Micro-benchmark of the data dictionary parsers against a large generated data dictionary.
+Each case times the legacy per-variable implementation kept here as a reference against
+the current one in preprocess.py and checks that both build the same dictionary.
+
+usage: python benchmarks/bench_questions.py [--variables 200 2000] [--values 20] [--repeat 3]
+"""
+
+BENCH_DIR = Path(__file__).resolve().parent
+PACKAGE_DIR = BENCH_DIR.parent
+sys.path.insert(0, str(PACKAGE_DIR))
+
+
+def _legacy_query_dictionary(variables_df: pd.DataFrame, lookup_df: pd.DataFrame, person_cols: list) -> dict:
+    """
+    Reference: the per-column build process_MyDailyTravelData used before the indexed rewrite
+    """
+    from preprocess import _MDT_REPLACEMENTS
+    import re
+
+    def clean_and_replace(text: str, replacements: dict) -> str:
+        text = " ".join(text.split())
+        def replace_match(match):
+            key = match.group(1)
+            return replacements.get(key, match.group(0))
+        return re.sub(r"\[\$(.*?)\]", replace_match, text)
+
+    query_dictionary = {}
+    for col in person_cols:
+        if col.upper() in variables_df["NAME"].to_list():
+            try:
+                lookup_table = lookup_df[lookup_df["NAME"]==col.upper()]
+                query_dictionary[col.upper()] = {
+                    "question":(variables_df[variables_df["NAME"] == col.upper()]["QUESTION TEXT"].values)[0],
+                    "dtype":(variables_df[variables_df["NAME"] == col.upper()]["DATA TYPE"].values)[0],
+                    "response": lookup_table.set_index("VALUE_INT")["LABEL"].to_dict()
+                }
+            except:
+                query_dictionary[col.upper()] = "This didnt work"
+
+    for survey_variable, question_response in query_dictionary.items():
+        if "question" in question_response.keys():
+            question_text = query_dictionary[survey_variable]["question"]
+            query_dictionary[survey_variable]["question"] = clean_and_replace(question_text, _MDT_REPLACEMENTS)
+    return query_dictionary
+
+
+def _legacy_pums_data(config_folder: str) -> dict:
+    """
+    Reference: the per-variable scan process_pums_data used before the grouped rewrite
+    """
+    data_path = Path(config_folder) / "data"
+    dd = pd.read_csv(*data_path.glob("PUMS_Data_Dictionary*.csv"), header=None, names=list("abcdefg"))
+    variable_desc = dd[dd.a == "NAME"].set_index("b")["e"].to_dict()
+    df = pd.read_csv(*data_path.glob("psam_p*.csv"), nrows=1)
+    pums_variable_dict = {k:v for k,v in variable_desc.items() if k in df.columns.values}
+    mapper = {}
+    for variable,description in pums_variable_dict.items():
+        description_row = dd[(dd.a!="NAME") & (dd.b==variable)]
+        answers = description_row[["f","g"]].drop_duplicates().fillna("MISSING").set_index("f")["g"].to_dict()
+        mapper[variable] = {"description": description, "dtype": description_row.c.iloc[0], "answers": answers}
+    return mapper
+
+
+def _legacy_insee_census(config_folder: str) -> dict:
+    """
+    Reference: the per-variable scan process_insee_census used before the grouped rewrite
+    """
+    df = pd.read_csv(Path(config_folder) / "data" / "varmod_indcvi_2021.csv", sep=";")
+    mapper = {}
+    for var in df.COD_VAR.unique():
+        filtered_df = df[df.COD_VAR==var]
+        row_match = filtered_df.iloc[0]
+        mapper[var] = {
+            "description": row_match.LIB_VAR,
+            "dtype": row_match.TYPE_VAR,
+            "answers": dict(zip(filtered_df["COD_MOD"], filtered_df["LIB_MOD"]))}
+    return mapper
+
+
+def write_census_dictionaries(config_folder: Path, n_variables: int, n_values: int, seed: int = 0) -> None:
+    """
+    Writes generated PUMS and INSEE data dictionaries, and a PUMS person header, to config_folder/data
+    """
+    rng = np.random.default_rng(seed)
+    data_path = config_folder / "data"
+    data_path.mkdir(parents=True, exist_ok=True)
+    names = [f"V{i}" for i in range(n_variables)]
+
+    rows = []
+    for name in names:
+        dtype = rng.choice(["C", "N"])
+        rows.append(["NAME", name, dtype, 2, f"description of {name}", None, None])
+        for value in range(n_values):
+            code = f"{value:02d}" if value else None
+            rows.append(["VAL", name, dtype, 2, code, code, f"label {name} {value}"])
+    pd.DataFrame(rows).to_csv(data_path / "PUMS_Data_Dictionary_2019.csv", header=False, index=False)
+    pd.DataFrame(columns=["SERIALNO", "PUMA", *[name for name in names if rng.random() < 0.9]]) \
+        .to_csv(data_path / "psam_p17.csv", index=False)
+
+    insee = pd.DataFrame({
+        "COD_VAR": np.repeat(names, n_values),
+        "LIB_VAR": np.repeat([f"description of {name}" for name in names], n_values),
+        "COD_MOD": np.tile([f"{value:02d}" for value in range(n_values)], n_variables),
+        "LIB_MOD": [f"label {i}" for i in range(n_variables * n_values)],
+        "TYPE_VAR": np.repeat(rng.choice(["CHAR", "NUM"], n_variables), n_values)})
+    insee.to_csv(data_path / "varmod_indcvi_2021.csv", sep=";", index=False)
+
+
+def generate_mydailytravel_dictionary(n_variables: int, n_values: int, seed: int = 0) -> tuple:
+    """
+    Returns (variables_df, lookup_df, person_cols) shaped like the MyDailyTravel data dictionary
+    """
+    rng = np.random.default_rng(seed)
+    names = [f"VAR{i}" for i in range(n_variables)]
+    placeholders = ["[$YOU]", "[$DO_YOU]", "[$YOUR]", "[$UNKNOWN]", ""]
+    variables_df = pd.DataFrame({
+        "NAME": names,
+        "QUESTION TEXT": [
+            f"How often {placeholders[i % len(placeholders)]} travel  \n for reason {i}? {placeholders[(i * 7) % len(placeholders)]}"
+            for i in range(n_variables)],
+        "DATA TYPE": rng.choice(["NUMERIC", "SINGLE", "MULTIPLE", "TEXT"], n_variables)})
+
+    lookup_names = np.repeat(names, n_values)
+    values = np.tile(np.arange(-9, n_values - 9), n_variables)
+    lookup_df = pd.DataFrame({
+        "NAME": lookup_names,
+        "VALUE": values,
+        "LABEL": [f"label {name} {value}" for name, value in zip(lookup_names, values)]})
+    lookup_df["VALUE_INT"] = lookup_df["VALUE"].astype(int)
+    lookup_df = lookup_df.sample(frac=1.0, random_state=seed).reset_index(drop=True)
+
+    # person.csv holds most variables in lower case plus a few columns missing from the dictionary
+    person_cols = [name.lower() for name in names if rng.random() < 0.9] + ["sampno", "perno", "wtperfin"]
+    return variables_df, lookup_df, person_cols
+
+
+def _report(name: str, n_variables: int, n_values: int, legacy_s: float, current_s: float) -> None:
+    print(
+        f"{name:>14} variables={n_variables:<6} values={n_values:<4} "
+        f"legacy {legacy_s:8.3f}s current {current_s:8.3f}s x{legacy_s / current_s:6.1f}")
+
+
+def _time(fn, repeat: int, *args) -> tuple:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the data dictionary parsers")
+    parser.add_argument("--variables", nargs="+", type=int, default=[200, 2000])
+    parser.add_argument("--values", type=int, default=20, help="lookup values per variable")
+    parser.add_argument("--repeat", type=int, default=3)
+    return parser.parse_args()
+
+
+def main():
+    from preprocess import _build_query_dictionary, process_pums_data, process_insee_census
+    args = _parse_args()
+
+    for n_variables in args.variables:
+        inputs = generate_mydailytravel_dictionary(n_variables, args.values)
+        legacy_s, legacy = _time(_legacy_query_dictionary, args.repeat, *inputs)
+        current_s, current = _time(_build_query_dictionary, args.repeat, *inputs)
+        assert current == legacy, "query dictionary differs from the legacy build"
+        assert list(current) == list(legacy), "query dictionary order differs from the legacy build"
+        _report("MyDailyTravel", n_variables, args.values, legacy_s, current_s)
+
+        with tempfile.TemporaryDirectory() as config_folder:
+            write_census_dictionaries(Path(config_folder), n_variables, args.values)
+            for name, legacy_fn, current_fn in [
+                    ("PUMS", _legacy_pums_data, process_pums_data),
+                    ("INSEE", _legacy_insee_census, process_insee_census)]:
+                legacy_s, legacy = _time(legacy_fn, args.repeat, config_folder)
+                current_s, current = _time(current_fn, args.repeat, config_folder)
+                assert current == legacy, f"{name} mapper differs from the legacy build"
+                assert list(current) == list(legacy), f"{name} mapper order differs from the legacy build"
+                _report(name, n_variables, args.values, legacy_s, current_s)
+
+
+if __name__ == "__main__":
+    main()
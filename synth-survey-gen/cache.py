@@ -0,0 +1,106 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import List, Tuple
+
+
+class ResponseCache:
+    def __init__(self, path: str, max_size_mb: float = 512):
+        """
+        On-disk SQLite cache of LLM responses. Entries are keyed on the chat model, sampling
+        parameters and full message history, and the least recently used entries are evicted
+        once the stored responses exceed max_size_mb. A replayed run sends the same messages, and
+        so hits the cache, since render_seed, which seeds the bios and the response option
+        shuffle, is fixed whenever the cache is on.
+
+        Args:
+            path (str): SQLite database file, created if missing
+            max_size_mb (float, optional): Size cap of cached response content. Defaults to 512.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                content TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses (last_access)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def key(chat_model: str, temperature: float, seed: int | None, messages: List[Tuple[str, str]]) -> str:
+        """
+        Returns cache key of a request
+
+        Args:
+            chat_model (str): chat model of the LLM config
+            temperature (float): sampling temperature
+            seed (int | None): sampling seed
+            messages (List[Tuple[str, str]]): (role, content) of every message sent to the model
+        """
+        message_hash = hashlib.sha256(json.dumps(messages).encode("utf-8")).hexdigest()
+        return f"{chat_model}|{temperature}|{seed}|{message_hash}"
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute("SELECT content FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, content: str) -> None:
+        size = len(content.encode("utf-8"))
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, content, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, content, size, time.time()))
+            self._size += size - (old[0] if old else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """
+        Deletes least recently used entries until the cache is under its size cap
+        """
+        if self._size <= self.max_size:
+            return
+        excess = self._size - self.max_size
+        freed = 0
+        stale_keys = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            stale_keys.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+        self._size -= freed
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size_mb": self._size / (1024 * 1024)
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
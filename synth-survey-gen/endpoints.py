@@ -0,0 +1,142 @@
+import time
+import asyncio
+import threading
+import urllib.request
+from typing import List
+import numpy as np
+import langroid.language_models as lm
+from langroid.language_models.openai_gpt import OLLAMA_BASE_URL
+
+
+class _Endpoint:
+    def __init__(self, llm_config: lm.OpenAIGPTConfig):
+        self.config = llm_config
+        self.llm = lm.OpenAIGPT(llm_config)
+        self.api_base = _api_base(llm_config)
+        self.name = llm_config.api_base or llm_config.chat_model
+        self.in_flight = 0
+        self.n_requests = 0
+        self.n_errors = 0
+        self.latencies = []
+        self.healthy = True
+        self.retry_at = 0.0
+
+    @property
+    def models_url(self) -> str:
+        return self.api_base.rstrip("/") + "/models"
+
+
+def _api_base(llm_config: lm.OpenAIGPTConfig) -> str:
+    """
+    Base url of an endpoint: api_base when set, else the url langroid serves local/ and
+    ollama/ chat models from. Other endpoints can not be health checked without one.
+    """
+    if llm_config.api_base:
+        return llm_config.api_base
+    prefix, _, address = llm_config.chat_model.partition("/")
+    if prefix == "ollama":
+        return OLLAMA_BASE_URL
+    if prefix == "local":
+        return "http://" + address
+    raise ValueError(f"Endpoint {llm_config.chat_model} needs an api_base in the endpoints list")
+
+
+class EndpointPool:
+    def __init__(self, llm_configs: List[lm.OpenAIGPTConfig], retry_after: float = 30.0, probe_timeout: float = 2.0):
+        """
+        Routes LLM requests across several server endpoints. Each request goes to the healthy
+        endpoint with the fewest requests in flight. An endpoint that fails a request is taken
+        out of rotation and health checked again after retry_after seconds.
+
+        Args:
+            llm_configs (List[lm.OpenAIGPTConfig]): One LLM config per endpoint
+            retry_after (float, optional): Seconds before a failed endpoint is probed again. Defaults to 30.0.
+            probe_timeout (float, optional): Seconds to wait on a health check. Defaults to 2.0.
+        """
+        self.endpoints = [_Endpoint(config) for config in llm_configs]
+        self.retry_after = retry_after
+        self.probe_timeout = probe_timeout
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def acquire(self) -> _Endpoint:
+        """
+        Returns the least loaded healthy endpoint and counts a request in flight on it.
+        Falls back to the endpoint that failed longest ago when none are healthy.
+        """
+        for endpoint in self._due_probes():
+            self._probe(endpoint)
+        return self._select()
+
+    async def acquire_async(self) -> _Endpoint:
+        """
+        acquire for the event loop, health checks run in worker threads so a slow or down
+        endpoint does not stall the other agents' requests
+        """
+        await asyncio.gather(*(asyncio.to_thread(self._probe, endpoint) for endpoint in self._due_probes()))
+        return self._select()
+
+    def _due_probes(self) -> List[_Endpoint]:
+        """
+        Claims the failed endpoints due for a health check, so concurrent acquires probe each once
+        """
+        now = time.time()
+        with self._lock:
+            due = [endpoint for endpoint in self.endpoints if not endpoint.healthy and endpoint.retry_at <= now]
+            for endpoint in due:
+                endpoint.retry_at = now + self.retry_after
+        return due
+
+    def _select(self) -> _Endpoint:
+        with self._lock:
+            healthy = [endpoint for endpoint in self.endpoints if endpoint.healthy]
+            if healthy:
+                endpoint = min(healthy, key=lambda e: (e.in_flight, _mean(e.latencies)))
+            else:
+                endpoint = min(self.endpoints, key=lambda e: e.retry_at)
+            endpoint.in_flight += 1
+            endpoint.n_requests += 1
+        return endpoint
+
+    def release(self, endpoint: _Endpoint, latency: float | None, ok: bool = True) -> None:
+        """
+        Ends a request on endpoint. A failed request takes the endpoint out of rotation.
+        A latency of None (cancelled request) is not recorded.
+        """
+        with self._lock:
+            endpoint.in_flight -= 1
+            if not ok:
+                endpoint.n_errors += 1
+                endpoint.healthy = False
+                endpoint.retry_at = time.time() + self.retry_after
+            elif latency is not None:
+                endpoint.latencies.append(latency)
+
+    def _probe(self, endpoint: _Endpoint) -> None:
+        try:
+            with urllib.request.urlopen(endpoint.models_url, timeout=self.probe_timeout) as response:
+                healthy = response.status == 200
+        except Exception:
+            healthy = False
+
+        with self._lock:
+            endpoint.healthy = healthy
+            if not healthy:
+                endpoint.retry_at = time.time() + self.retry_after
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                endpoint.name: {
+                    "requests": endpoint.n_requests,
+                    "errors": endpoint.n_errors,
+                    "healthy": endpoint.healthy,
+                    "latency_mean_s": _mean(endpoint.latencies),
+                    "latency_p95_s": float(np.percentile(endpoint.latencies, 95)) if endpoint.latencies else 0.0
+                } for endpoint in self.endpoints}
+
+
+def _mean(values: List[float]) -> float:
+    return sum(values) / len(values) if values else 0.0
@@ -0,0 +1,240 @@
+import io
+import os
+import time
+import gzip
+import json
+import threading
+from pathlib import Path
+from dataclasses import asdict
+from typing import Iterator, Set, Tuple, IO
+from survey import AgentResponsePackage, bio_hash
+
+_EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+class BioStore:
+    def __init__(self, RUN_FOLDER: str, date_str: str):
+        """
+        Content-addressed table of agent bios of a run. Each distinct bio is appended once
+        to <date>_bios.jsonl under its bio_hash; results reference the hash.
+
+        Args:
+            RUN_FOLDER (str): run folder of the survey
+            date_str (str): run timestamp used as file prefix
+        """
+        self.path = bios_path(RUN_FOLDER, date_str)
+        self._lock = threading.Lock()
+        self._hashes = set(load_bios(self.path).keys()) if self.path.exists() else set()
+
+    def add(self, agent_bio: str, agent_bio_hash: str | None = None) -> str:
+        agent_bio_hash = agent_bio_hash or bio_hash(agent_bio)
+        with self._lock:
+            if agent_bio_hash not in self._hashes:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"bio_hash": agent_bio_hash, "agent_bio": agent_bio}) + "\n")
+                self._hashes.add(agent_bio_hash)
+        return agent_bio_hash
+
+
+def bios_path(RUN_FOLDER: str | Path, date_str: str) -> Path:
+    return Path(RUN_FOLDER) / "_".join((date_str, "bios.jsonl"))
+
+
+def load_bios(path: str | Path) -> dict:
+    """
+    Returns {bio_hash: agent_bio} of a run's bio table
+    """
+    bios = {}
+    path = Path(path)
+    if not path.exists():
+        return bios
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            bios[record["bio_hash"]] = record["agent_bio"]
+    return bios
+
+
+class RunJournal:
+    def __init__(self, RUN_FOLDER: str, date_str: str, compression: str | None = None, fsync_interval: float = 0.0, bio_store: BioStore | None = None):
+        """
+        Append-only, line-delimited results log of a run. Each AgentResponsePackage is
+        written as one JSON line as it arrives and flushed right away, so a killed run
+        loses at most the record being written. The log doubles as the journal of
+        completed agents used to resume a run.
+
+        Args:
+            RUN_FOLDER (str): run folder of the survey
+            date_str (str): run timestamp used as file prefix
+            compression (str | None, optional): None, "gzip" or "zstd" (needs the zstandard package). Defaults to None.
+            fsync_interval (float, optional): Seconds between fsyncs to disk, 0 syncs every record. Defaults to 0.0.
+            bio_store (BioStore | None, optional): Stores agent_bio once in the bio table and logs only
+                its bio_hash. Defaults to None.
+        """
+        if compression not in _EXTENSIONS:
+            raise ValueError(f"Unknown results compression {compression}, use one of {list(_EXTENSIONS)}")
+        if compression == "zstd":
+            # fail before the run rather than on the first record
+            import zstandard
+        self.compression = compression
+        self.path = Path(RUN_FOLDER) / ("_".join((date_str, "results.jsonl")) + _EXTENSIONS[compression])
+        self.fsync_interval = fsync_interval
+        self.bio_store = bio_store
+        self._lock = threading.Lock()
+        self._raw = None
+        self._file = None
+        self._last_sync = 0.0
+
+    def record(self, agent_response: AgentResponsePackage) -> None:
+        record = asdict(agent_response)
+        if self.bio_store is not None and record["agent_bio"] is not None:
+            record["bio_hash"] = self.bio_store.add(record["agent_bio"], record["bio_hash"])
+            record["agent_bio"] = None
+        line = json.dumps(record)
+        with self._lock:
+            if self._file is None:
+                if self.compression is not None and self.path.exists():
+                    self._recover()
+                self._raw, self._file = _open_writer(self.path, self.compression)
+                if self.compression is None and _ends_mid_line(self.path):
+                    # end the partial record of a killed run so it does not swallow this one
+                    self._file.write("\n")
+            self._file.write(line + "\n")
+            self._file.flush()
+            if time.time() - self._last_sync >= self.fsync_interval:
+                self._raw.flush()
+                os.fsync(self._raw.fileno())
+                self._last_sync = time.time()
+
+    def _recover(self) -> None:
+        """
+        Rewrites the complete records of a compressed log before appending to it, since a
+        stream cut short by a killed run cannot be followed by new compressed data
+        """
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        raw, f = _open_writer(tmp_path, self.compression)
+        with f:
+            for record in read_results_log(self.path, self.compression):
+                f.write(json.dumps(record) + "\n")
+        if not raw.closed:
+            raw.close()
+        os.replace(tmp_path, self.path)
+
+    def replay(self, raw: bool = False, with_bios: bool = False) -> Iterator[AgentResponsePackage | dict]:
+        """
+        Streams back every logged AgentResponsePackage, one record at a time. A partial
+        last record left by a killed run is ignored.
+
+        Args:
+            raw (bool, optional): Yield the decoded dicts instead of AgentResponsePackages. Defaults to False.
+            with_bios (bool, optional): Join agent_bio back from the bio table. Defaults to False.
+        """
+        bios = load_bios(self.bio_store.path) if with_bios and self.bio_store is not None else None
+        yield from read_results_log(self.path, self.compression, raw=raw, bios=bios)
+
+    def completed(self) -> Set[Tuple[str, str]]:
+        """
+        Returns (agent_id, serial_number) keys of logged agents
+        """
+        return {_agent_key(r["agent_id"], r["serial_number"]) for r in self.replay(raw=True)}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                if not self._raw.closed:
+                    self._raw.close()
+                self._file = None
+                self._raw = None
+
+
+def read_results_log(path: str | Path, compression: str | None = None, raw: bool = True, bios: dict | None = None) -> Iterator[AgentResponsePackage | dict]:
+    """
+    Streams records of a results log written by RunJournal. Compression is taken from the
+    file extension when not given. Given a bio table from load_bios, agent_bio is joined
+    back on bio_hash.
+    """
+    path = Path(path)
+    if not path.exists():
+        return
+    if compression is None:
+        compression = {".gz": "gzip", ".zst": "zstd"}.get(path.suffix)
+
+    with _open_reader(path, compression) as f:
+        try:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if bios is not None and record.get("agent_bio") is None:
+                    record["agent_bio"] = bios.get(record.get("bio_hash"))
+                yield record if raw else AgentResponsePackage(**record)
+        except (EOFError, gzip.BadGzipFile, OSError, ValueError):
+            # compressed stream cut short by a killed run
+            return
+
+
+def _open_writer(path: Path, compression: str | None) -> Tuple[IO, IO]:
+    """
+    Returns the underlying file and text stream to append records to
+    """
+    raw = open(path, "ab")
+    if compression == "gzip":
+        return raw, io.TextIOWrapper(gzip.GzipFile(fileobj=raw, mode="ab"), encoding="utf-8")
+    if compression == "zstd":
+        import zstandard
+        writer = zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+        return raw, io.TextIOWrapper(_ZstdBlockWriter(writer), encoding="utf-8")
+    return raw, io.TextIOWrapper(raw, encoding="utf-8")
+
+
+def _open_reader(path: Path, compression: str | None) -> IO:
+    if compression == "gzip":
+        return gzip.open(path, "rt", encoding="utf-8")
+    if compression == "zstd":
+        import zstandard
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+        return io.TextIOWrapper(reader, encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+class _ZstdBlockWriter(io.RawIOBase):
+    """
+    Flushes a zstd block on every flush so each record is decodable once written
+    """
+    def __init__(self, writer):
+        self._writer = writer
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._writer.write(b)
+        return len(b)
+
+    def flush(self):
+        import zstandard
+        if not self.closed:
+            self._writer.flush(zstandard.FLUSH_BLOCK)
+
+    def close(self):
+        if not self.closed:
+            self._writer.close()
+        super().close()
+
+
+def _agent_key(agent_id, serial_number) -> Tuple[str, str]:
+    return str(agent_id), str(serial_number)
+
+
+def _ends_mid_line(path: Path) -> bool:
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return False
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
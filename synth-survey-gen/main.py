@@ -1,25 +1,23 @@
 import sys
 import os
+import argparse
+import pandas as pd
 from pathlib import Path
 import threading
 import time
+from itertools import islice
 from queue import Queue, Empty
 from tqdm import tqdm
 from typing import Dict, List
-from preprocess import generate_questions
-from synthesize import load_config, build_agents, SurveyAgent
+from preprocess import load_questions
+from synthesize import load_config, build_agents, build_llm, AgentFactory
 from survey import SurveyEngine
 from postprocess import ProcessSurveyResponse
+from journal import RunJournal, BioStore
+from cache import ResponseCache
 from types import SimpleNamespace
 from langroid.utils.configuration import settings
 
-if len(sys.argv) < 2:
-    print("Usage: python main.py path/to/config/ [path/to/runfolder]")
-    sys.exit(1)
-
-config_folder = sys.argv[1]
-RUN_FOLDER = sys.argv[2] if len(sys.argv) > 2 else None
-
 settings.quiet = True
 
 def run_survey(
@@ -27,36 +25,38 @@ def run_survey(
     stop_event: threading.Event,
     survey_conf: Dict,
     questions: Dict,
-    agents: List[SurveyAgent],
+    agents: AgentFactory,
     batch_size: int,
     shuffle_response: bool,
-    timeout_per_batch: float = 600000  # seconds
+    max_concurrency: int | None = None,
+    question_timeout: float | None = None,  # seconds
+    agent_timeout: float | None = None,     # seconds
+    schedule: str = "agent"
 ):
+    # batches are lazy slices of the agent factory, agents are built as the engine needs them
+    agent_iter = iter(agents)
     try:
         for i in tqdm(range(0, len(agents), batch_size), desc="running batches"):
-            batch = agents[i: i+batch_size]
-
-            def batch_runner():
-                nonlocal batch_results
-                SE = SurveyEngine(survey_conf, questions, batch, shuffle_response)
-                SE.run()
-                batch_results = SE.results()
-
-            batch_results = []
-            thread = threading.Thread(target=batch_runner)
-            thread.start()
-            thread.join(timeout=timeout_per_batch)
-
-            if thread.is_alive():
-                print(f"Batch {i // batch_size} timed out. Skipping.")
-                continue  # skip to next batch
-
-            for r in batch_results:
-                result_queue.put(r)
+            batch = islice(agent_iter, batch_size)
+
+            # deadlines are enforced per question and per agent inside the engine,
+            # stream each finished agent straight to the postprocessing thread
+            SE = SurveyEngine(
+                survey_conf,
+                questions,
+                batch,
+                shuffle_response,
+                max_concurrency=max_concurrency,
+                question_timeout=question_timeout,
+                agent_timeout=agent_timeout,
+                schedule=schedule)
+            SE.run(on_result=result_queue.put)
 
     except Exception as e:
         print(f"Exception in run_survey: {e}")
     finally:
+        # the factory holds its render pool open until its iterator is closed
+        agent_iter.close()
         stop_event.set()
 
 
@@ -64,31 +64,44 @@ def postprocess_response(
     result_queue: Queue,
     stop_event: threading.Event,
     postprocessor: ProcessSurveyResponse,
+    journal: RunJournal,
     date_str: str):
     while not stop_event.is_set() or not result_queue.empty():
         try:
             result = result_queue.get(timeout=1.0)
-            postprocessor.serialize_response(result)
         except Empty:
             continue
+
+        # journal first, a surveyed agent is skipped on resume even when postprocessing it fails
+        try:
+            journal.record(result)
         except Exception as e:
-            print(f"Error at postprocess thread: {e}")
+            print(f"Error at results journal: {e}")
             print(type(e))
 
+        try:
+            postprocessor.serialize_response(result)
+        except Exception as e:
+            print(f"Error at postprocess thread: {e}")
+            print(type(e))
 
-def main():
-    global RUN_FOLDER
 
+def main(config_folder: str, RUN_FOLDER: str | None = None, resume: str | None = None):
     start_time = time.time()
-    date_str = time.strftime("%Y%m%d_%H%M")
-    name_str = Path(config_folder).name
-    dir_name = "_".join((name_str, date_str))
 
-    if RUN_FOLDER is None:
-        dir_name = "_".join((name_str, date_str))
-        RUN_FOLDER = os.path.join("run", dir_name)
+    if resume is not None:
+        # pick up the run folder and timestamp of the interrupted run
+        RUN_FOLDER = resume
+        date_str = "_".join(Path(RUN_FOLDER).name.split("_")[-2:])
     else:
-        RUN_FOLDER = os.path.join(RUN_FOLDER, dir_name)
+        date_str = time.strftime("%Y%m%d_%H%M")
+        name_str = Path(config_folder).name
+        dir_name = "_".join((name_str, date_str))
+
+        if RUN_FOLDER is None:
+            RUN_FOLDER = os.path.join("run", dir_name)
+        else:
+            RUN_FOLDER = os.path.join(RUN_FOLDER, dir_name)
 
     os.makedirs(RUN_FOLDER, exist_ok=True)
 
@@ -102,8 +115,26 @@ def main():
     shuffle_response = synth.shuffle_response
     shuffle_prompt = synth.shuffle_response
     wrap = synth.wrap
+    max_concurrency = synth_conf.get("max_concurrency") # None runs agents sequentially
+    question_timeout = synth_conf.get("question_timeout")
+    agent_timeout = synth_conf.get("agent_timeout")
+    schedule = synth_conf.get("schedule", "agent") # "lockstep" for question-major waves
+    cache_conf = synth_conf.get("response_cache") # None disables the response cache, a null render_seed is then fixed
+
+    questions = load_questions(config_folder, source=source) # needs source config
 
-    questions = generate_questions(config_folder, source=source) # needs source config
+    # rebuild the same population on resume
+    population_path = os.path.join(RUN_FOLDER, "_".join((date_str, "population_sample.csv")))
+    population_sample = pd.read_csv(population_path, dtype=str) if resume is not None else None
+
+    response_cache = None
+    if cache_conf:
+        response_cache = ResponseCache(
+            cache_conf.get("path", os.path.join(config_folder, "cache", "responses.sqlite")),
+            max_size_mb=cache_conf.get("max_size_mb", 512))
+
+    # one or more LLM endpoints from the model block
+    llm_config, endpoint_pool = build_llm(model_conf)
 
     # add shuffle here please
     agents, population_sample = build_agents(
@@ -111,16 +142,40 @@ def main():
         n=n,
         subsample=subsample,
         source=source,
+        population_sample=population_sample,
+        response_cache=response_cache,
+        llm_config=llm_config,
+        endpoint_pool=endpoint_pool,
         shuffle=shuffle_prompt,
         wrap=wrap)
 
+    # write population up front so an interrupted run can be resumed
+    if resume is None:
+        population_sample.to_csv(population_path, index=False)
+
     # needs source config
     postprocessor = ProcessSurveyResponse(
         config_folder,
         batch_size=batch_size,
         RUN_FOLDER=RUN_FOLDER,
         source=source,
-        date_str=date_str)
+        date_str=date_str,
+        flush_interval=synth_conf.get("flush_interval"),
+        max_buffer_mb=synth_conf.get("max_buffer_mb"))
+
+    # results log, also used to skip agents already surveyed and restore their results
+    journal = RunJournal(
+        RUN_FOLDER,
+        date_str,
+        compression=synth_conf.get("results_compression"),
+        fsync_interval=synth_conf.get("fsync_interval", 0.0),
+        bio_store=BioStore(RUN_FOLDER, date_str))
+    n_resumed = 0
+    if resume is not None:
+        for result in journal.replay():
+            postprocessor.serialize_response(result)
+            n_resumed += 1
+        agents.skip(journal.completed())
 
     result_queue = Queue()
 
@@ -135,25 +190,28 @@ def main():
             questions,
             agents,
             batch_size,
-            shuffle_response))
+            shuffle_response,
+            max_concurrency,
+            question_timeout,
+            agent_timeout,
+            schedule))
 
     postprocessing_thread = threading.Thread(
         target=postprocess_response,
-        args=(result_queue, stop_event, postprocessor, date_str))
+        args=(result_queue, stop_event, postprocessor, journal, date_str))
 
     survey_thread.start()
     postprocessing_thread.start()
     survey_thread.join()
     postprocessing_thread.join()
+    journal.close()
 
     end_time = time.time()
     duration_hour = (end_time - start_time) / 3600.00
 
-    write_success = postprocessor.write_results(RUN_FOLDER, date_str)
+    write_success = postprocessor.write_results(RUN_FOLDER, date_str, results_log=journal.path)
 
     # logging
-    population_sample.to_csv(os.path.join(RUN_FOLDER, "_".join((date_str, "population_sample.csv"))), index=False)
-
     log_path = os.path.join(RUN_FOLDER, "log.txt")
     with open(log_path, "w") as f:
         f.write(f"Start Time: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time))}\n")
@@ -169,5 +227,27 @@ def main():
         for key, value in synth_conf.items():
             f.write(f"{key}: {value}\n")
 
+        f.write(f"\nResumed agents: {n_resumed}\n")
+
+        if response_cache is not None:
+            f.write("\nResponse Cache:\n")
+            for key, value in response_cache.stats().items():
+                f.write(f"{key}: {value}\n")
+            response_cache.close()
+
+        if endpoint_pool is not None:
+            f.write("\nEndpoints:\n")
+            for name, endpoint_stats in endpoint_pool.stats().items():
+                f.write(f"{name}: {endpoint_stats}\n")
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Run a synthetic survey")
+    parser.add_argument("config_folder", help="path/to/config/")
+    parser.add_argument("run_folder", nargs="?", default=None, help="path/to/runfolder")
+    parser.add_argument("--resume", metavar="RUN_FOLDER", default=None, help="resume an interrupted run in RUN_FOLDER")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = _parse_args()
+    main(args.config_folder, args.run_folder, resume=args.resume)
\ No newline at end of file
@@ -0,0 +1,312 @@
+from survey import AgentResponsePackage
+from journal import read_results_log
+from dataclasses import asdict
+from pathlib import Path
+from typing import Dict, Iterable, List
+import numpy as np
+import pandas as pd
+import json
+
+# kind codes of a response cell
+UNVISITED = 0
+INTEGER   = 1
+TEXT      = 2
+MULTIPLE  = 3
+EMPTY     = 4
+
+
+class ResponseMatrix:
+    def __init__(self, variables: Iterable[str] | None = None, capacity: int = 1024):
+        """Compact store of completed surveys
+
+        Survey variables and tool dtypes are mapped to integer ids. Every agent is a row of an
+        agents x questions int64 code matrix, with a kind matrix telling integer codes from
+        indices into the free-text arena (text responses, multiple choice lists) and a visited
+        mask of the questions the survey logic reached. Scraps are kept in the arena as well.
+
+        Args:
+            variables (Iterable[str] | None, optional): Survey variables to reserve columns for,
+                unseen variables are added as they are logged. Defaults to None.
+            capacity (int, optional): Initial number of agent rows. Defaults to 1024.
+        """
+        self.variables: List[str] = []
+        self.variable_ids: Dict[str, int] = {}
+        self.dtypes: List[str] = []
+        self.dtype_ids: Dict[str, int] = {}
+        self.arena: List[str | List[int]] = []
+
+        self.agent_ids: List[str] = []
+        self.serial_numbers: List[str] = []
+        self.bio_hashes: List[str | None] = []
+
+        self.n_agents = 0
+        self._capacity = max(capacity, 1)
+        self._allocate(self._capacity, 0)
+        for variable in variables or []:
+            self._variable_id(variable)
+
+    def _allocate(self, rows: int, cols: int) -> None:
+        self.codes        = np.zeros((rows, cols), dtype=np.int64)
+        self.kinds        = np.zeros((rows, cols), dtype=np.int8)
+        self.tool_dtypes  = np.full((rows, cols), -1, dtype=np.int16)
+        self.dtype_match  = np.zeros((rows, cols), dtype=bool)
+        self.order        = np.full((rows, cols), -1, dtype=np.int16)
+        self.scraps       = np.full((rows, cols), -1, dtype=np.int64)
+        self.n_questions  = np.zeros(rows, dtype=np.int16)
+        self.bad_iteration = np.zeros(rows, dtype=bool)
+        self.timed_out    = np.zeros(rows, dtype=bool)
+
+    def _resize(self, rows: int, cols: int) -> None:
+        """
+        Grows every array to rows x cols, keeping the logged agents
+        """
+        old = {name: getattr(self, name) for name in self._arrays()}
+        self._allocate(rows, cols)
+        for name, array in old.items():
+            target = getattr(self, name)
+            if array.ndim == 2:
+                target[:array.shape[0], :array.shape[1]] = array
+            else:
+                target[:array.shape[0]] = array
+        self._capacity = rows
+
+    @staticmethod
+    def _arrays() -> List[str]:
+        return ["codes", "kinds", "tool_dtypes", "dtype_match", "order", "scraps",
+                "n_questions", "bad_iteration", "timed_out"]
+
+    def _variable_id(self, variable: str) -> int:
+        variable_id = self.variable_ids.get(variable)
+        if variable_id is None:
+            variable_id = len(self.variables)
+            self.variable_ids[variable] = variable_id
+            self.variables.append(variable)
+            if variable_id >= self.codes.shape[1]:
+                self._resize(self._capacity, max(2 * self.codes.shape[1], 16))
+        return variable_id
+
+    def _dtype_id(self, dtype: str) -> int:
+        dtype_id = self.dtype_ids.get(dtype)
+        if dtype_id is None:
+            dtype_id = len(self.dtypes)
+            self.dtype_ids[dtype] = dtype_id
+            self.dtypes.append(dtype)
+        return dtype_id
+
+    def _to_arena(self, value) -> int:
+        self.arena.append(value)
+        return len(self.arena) - 1
+
+    def _encode(self, value) -> tuple[int, int]:
+        """
+        Returns the (kind, code) of an encoded response
+        """
+        match value:
+            case None:
+                return EMPTY, 0
+            case bool() | int():
+                return INTEGER, int(value)
+            case float() if value.is_integer():
+                return INTEGER, int(value)
+            case list():
+                return MULTIPLE, self._to_arena(value)
+            case str():
+                return TEXT, self._to_arena(value.replace('\n', '').replace('\r', ''))
+            case _:
+                return TEXT, self._to_arena(str(value))
+
+    def append(self, agent_response: AgentResponsePackage | dict) -> None:
+        """
+        Logs one completed survey as a new agent row
+        """
+        if isinstance(agent_response, AgentResponsePackage):
+            agent_response = asdict(agent_response)
+
+        # reserve columns before sizing the rows
+        variable_ids = [self._variable_id(variable) for variable in agent_response["logic_flow"]]
+        if self.n_agents >= self._capacity:
+            self._resize(2 * self._capacity, self.codes.shape[1])
+
+        row = self.n_agents
+        self.agent_ids.append(agent_response["agent_id"])
+        self.serial_numbers.append(agent_response["serial_number"])
+        self.bio_hashes.append(agent_response.get("bio_hash"))
+        self.n_questions[row] = agent_response["n_questions"]
+        self.bad_iteration[row] = agent_response["bad_iteration"]
+        self.timed_out[row] = agent_response.get("timed_out", False)
+
+        rows = zip(
+            variable_ids,
+            agent_response["encoded_responses"],
+            agent_response["tool_dtypes"],
+            agent_response["dtype_matches"],
+            agent_response["responses_scraps"])
+        for position, (variable_id, value, tool_dtype, dtype_match, scrap) in enumerate(rows):
+            kind, code = self._encode(value)
+            self.kinds[row, variable_id] = kind
+            self.codes[row, variable_id] = code
+            self.tool_dtypes[row, variable_id] = self._dtype_id(tool_dtype)
+            self.dtype_match[row, variable_id] = dtype_match
+            self.order[row, variable_id] = position
+            if isinstance(scrap, str):
+                self.scraps[row, variable_id] = self._to_arena(scrap)
+
+        self.n_agents += 1
+
+    def extend(self, agent_responses: Iterable[AgentResponsePackage | dict]) -> "ResponseMatrix":
+        for agent_response in agent_responses:
+            self.append(agent_response)
+        return self
+
+    @classmethod
+    def from_results_log(cls, path: str | Path, variables: Iterable[str] | None = None) -> "ResponseMatrix":
+        """
+        Streams a RunJournal results log into a ResponseMatrix
+        """
+        return cls(variables).extend(read_results_log(path))
+
+    @property
+    def visited(self) -> np.ndarray:
+        """
+        agents x questions mask of the questions each agent was asked
+        """
+        return self.kinds[:self.n_agents, :len(self.variables)] != UNVISITED
+
+    def _column(self, variable_id: int, multiple_choice: bool = False) -> pd.api.extensions.ExtensionArray | np.ndarray:
+        kinds = self.kinds[:self.n_agents, variable_id]
+        codes = self.codes[:self.n_agents, variable_id]
+        if multiple_choice:
+            return self._multiple_choice_column(kinds, codes)
+
+        # several answers to a single answer variable keep their first integer, as the cleaned csv results do
+        multiple_rows = np.flatnonzero(kinds == MULTIPLE)
+        if multiple_rows.size:
+            kinds, codes = kinds.copy(), codes.copy()
+            for row in multiple_rows:
+                first = _first_int(self.arena[codes[row]])
+                kinds[row], codes[row] = (EMPTY, 0) if first is None else (INTEGER, first)
+        integers = kinds == INTEGER
+
+        # plain integer column stays a masked integer array
+        if not (kinds == TEXT).any():
+            return pd.arrays.IntegerArray(codes.copy(), ~integers)
+
+        column = np.full(self.n_agents, None, dtype=object)
+        column[integers] = codes[integers]
+        text_rows = np.flatnonzero(kinds == TEXT)
+        for row, index in zip(text_rows, codes[text_rows]):
+            column[row] = self.arena[index]
+        return column
+
+    def _multiple_choice_column(self, kinds: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """
+        Every answer of a multiple choice variable as a list, single answers wrapped like
+        ProcessSurveyResponse.serialize_response does
+        """
+        column = np.full(self.n_agents, None, dtype=object)
+        for row in np.flatnonzero(kinds != UNVISITED):
+            kind, code = kinds[row], codes[row]
+            if kind == INTEGER:
+                column[row] = [int(code)]
+            elif kind == MULTIPLE:
+                column[row] = [_coerce_to_int(value) for value in self.arena[code]]
+            elif kind == TEXT:
+                column[row] = [_coerce_to_int(self.arena[code])]
+            else:
+                column[row] = [None]
+        return column
+
+    def to_frame(self, lower: bool = True, multiple_choice: Iterable[str] = ()) -> pd.DataFrame:
+        """Agent x variable frame of encoded responses
+
+        Matches the test dataset of ResultsWriter: agent_id, serial_number and bio_hash followed by
+        one column per survey variable. Integer-only variables come out as Int64, unvisited
+        questions as missing. Answers are coerced as on the results csv: multiple choice variables
+        hold lists, other variables keep the first integer of a list answer.
+
+        Args:
+            lower (bool, optional): Lower case the variable columns as in the results csv. Defaults to True.
+            multiple_choice (Iterable[str], optional): Multiple choice variables, any case. Defaults to ().
+        """
+        multiple_choice = {variable.lower() for variable in multiple_choice}
+        frame = {
+            "agent_id": self.agent_ids,
+            "serial_number": self.serial_numbers,
+            "bio_hash": self.bio_hashes}
+        for variable, variable_id in self.variable_ids.items():
+            frame[variable.lower() if lower else variable] = self._column(variable_id, variable.lower() in multiple_choice)
+        return pd.DataFrame(frame)
+
+    def dtype_frame(self) -> pd.DataFrame:
+        """
+        Agent x variable frame of the tool dtype each question was answered with
+        """
+        tool_dtypes = self.tool_dtypes[:self.n_agents, :len(self.variables)]
+        frame = {
+            variable: pd.Categorical.from_codes(tool_dtypes[:, variable_id], categories=self.dtypes)
+            for variable, variable_id in self.variable_ids.items()}
+        return pd.DataFrame(frame, index=pd.Index(self.agent_ids, name="agent_id"))
+
+    def summary_frame(self) -> pd.DataFrame:
+        """
+        Per agent survey statistics
+        """
+        dtype_match = self.dtype_match[:self.n_agents, :len(self.variables)]
+        return pd.DataFrame({
+            "agent_id": self.agent_ids,
+            "n_questions": self.n_questions[:self.n_agents],
+            "n_dtype_matches": dtype_match.sum(axis=1),
+            "bad_iteration": self.bad_iteration[:self.n_agents],
+            "timed_out": self.timed_out[:self.n_agents]})
+
+    def save(self, path: str | Path) -> None:
+        """
+        Writes the matrix to a compressed .npz, the arena is kept as JSON strings
+        """
+        n, m = self.n_agents, len(self.variables)
+        arrays = {name: getattr(self, name)[:n, :m] if getattr(self, name).ndim == 2 else getattr(self, name)[:n]
+                  for name in self._arrays()}
+        np.savez_compressed(
+            path,
+            variables=np.array(self.variables, dtype=str),
+            dtypes=np.array(self.dtypes, dtype=str),
+            arena=np.array([json.dumps(value) for value in self.arena], dtype=str),
+            agent_ids=np.array(self.agent_ids, dtype=str),
+            serial_numbers=np.array(self.serial_numbers, dtype=str),
+            bio_hashes=np.array(["" if h is None else h for h in self.bio_hashes], dtype=str),
+            **arrays)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "ResponseMatrix":
+        with np.load(path) as data:
+            matrix = cls(data["variables"].tolist(), capacity=max(len(data["agent_ids"]), 1))
+            for dtype in data["dtypes"].tolist():
+                matrix._dtype_id(dtype)
+            matrix.arena = [json.loads(value) for value in data["arena"].tolist()]
+            matrix.agent_ids = data["agent_ids"].tolist()
+            matrix.serial_numbers = data["serial_numbers"].tolist()
+            matrix.bio_hashes = [h or None for h in data["bio_hashes"].tolist()]
+            matrix.n_agents = len(matrix.agent_ids)
+            for name in cls._arrays():
+                array = data[name]
+                target = getattr(matrix, name)
+                if array.ndim == 2:
+                    target[:array.shape[0], :array.shape[1]] = array
+                else:
+                    target[:array.shape[0]] = array
+        return matrix
+
+
+def _coerce_to_int(value):
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return value
+
+
+def _first_int(values: List) -> int | None:
+    for value in values:
+        value = _coerce_to_int(value)
+        if isinstance(value, int):
+            return value
+    return None
@@ -0,0 +1,236 @@
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import threading
+from collections import defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Tuple
+
+"""
+Deterministic stand-in for an OpenAI compatible LLM server. Answers survey
+questions with valid singleAnswerResponse, multipleAnswerResponse and
+discreteNumericResponse tool JSON so the survey pipeline can be run and
+benchmarked without a GPU or Ollama.
+"""
+
+_NUMERIC_MARKER = "Please provide a numeric response or select an alternative: "
+_TEXT_MARKER = "Available options: "
+_OPTION_KEY = re.compile(r"(?:^|; )(-?\d+): ")
+
+_SCRAPS = [
+    "Sure, here is my answer.",
+    "That's an easy one for me.",
+    "Let me think about that for a second.",
+    "Honestly, this is how it is for me.",
+    "",
+]
+
+
+def _question_keys(question: str) -> Tuple[str | None, List[int]]:
+    """
+    Returns the question dtype and response keys parsed from a queued survey question
+    """
+    for dtype, marker in (("NUMERIC", _NUMERIC_MARKER), ("TEXT", _TEXT_MARKER)):
+        if marker in question:
+            options = question.split(marker, 1)[1]
+            return dtype, [int(key) for key in _OPTION_KEY.findall(options)]
+    return None, []
+
+
+class MockLLMServer:
+    def __init__(
+            self,
+            host: str = "127.0.0.1",
+            port: int = 0,
+            latency: float = 0.0,
+            latency_jitter: float = 0.0,
+            error_rate: float = 0.0,
+            malformed_rate: float = 0.0,
+            multiple_rate: float = 0.1,
+            seed: int = 0):
+        """Mock LLM server
+
+        Responses depend only on the seed and the request messages, so repeated runs
+        produce the same answers, errors and malformed outputs.
+
+        Args:
+            host (str, optional): Bind address. Defaults to "127.0.0.1".
+            port (int, optional): Bind port, 0 picks a free port. Defaults to 0.
+            latency (float, optional): Mean seconds to answer a request. Defaults to 0.0.
+            latency_jitter (float, optional): Relative +/- spread of the latency. Defaults to 0.0.
+            error_rate (float, optional): Share of requests answered with HTTP 500. Defaults to 0.0.
+            malformed_rate (float, optional): Share of responses with truncated tool JSON. Defaults to 0.0.
+            multiple_rate (float, optional): Share of TEXT questions answered with multipleAnswerResponse. Defaults to 0.1.
+            seed (int, optional): Seed of the response generator. Defaults to 0.
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.multiple_rate = multiple_rate
+        self.seed = seed
+
+        # count attempts of failing requests so their retries can succeed, dropped once answered
+        self._attempts = defaultdict(int)
+        self._lock = threading.Lock()
+        self.n_requests = 0
+
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"{host}:{port}"
+
+    @property
+    def api_base(self) -> str:
+        return f"http://{self.address}/v1"
+
+    @property
+    def chat_model(self) -> str:
+        """
+        Langroid chat_model pointing at this server
+        """
+        return f"local/{self.address}/v1"
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _rng(self, request_hash: str) -> random.Random:
+        with self._lock:
+            attempt = self._attempts[request_hash]
+            self._attempts[request_hash] += 1
+            self.n_requests += 1
+        return random.Random(f"{self.seed}|{request_hash}|{attempt}")
+
+    def respond(self, messages: List[Dict]) -> Tuple[str | None, float]:
+        """
+        Returns the response content, or None for a server error, and the latency to wait
+        """
+        request_hash = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()
+        rng = self._rng(request_hash)
+        latency = max(self.latency * (1 + self.latency_jitter * (2 * rng.random() - 1)), 0.0)
+
+        if rng.random() < self.error_rate:
+            return None, latency
+
+        # answered, no retry to count
+        with self._lock:
+            self._attempts.pop(request_hash, None)
+
+        question = messages[-1].get("content") or "" if messages else ""
+        dtype, keys = _question_keys(question)
+
+        if dtype == "NUMERIC" and (not keys or rng.random() < 0.8):
+            tool = {"request": "discreteNumericResponse", "NUMERIC": rng.randint(0, 80)}
+        elif keys and rng.random() < self.multiple_rate:
+            tool = {"request": "multipleAnswerResponse", "TEXT": sorted(rng.sample(keys, rng.randint(1, min(3, len(keys)))))}
+        elif keys:
+            tool = {"request": "singleAnswerResponse", "TEXT": rng.choice(keys)}
+        else:
+            # not a survey question, answer in plain text
+            return "I would rather talk about my day.", latency
+
+        tool_json = json.dumps(tool)
+        if rng.random() < self.malformed_rate:
+            tool_json = tool_json[:-1]
+
+        scrap = rng.choice(_SCRAPS)
+        return f"{scrap}\n{tool_json}".strip(), latency
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, body: Dict):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]})
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                content, latency = server.respond(request.get("messages", []))
+                time.sleep(latency)
+
+                if content is None:
+                    self._send_json(500, {"error": {"message": "mock server error", "type": "server_error"}})
+                    return
+
+                model = request.get("model", "mock")
+                created = int(time.time())
+                if request.get("stream"):
+                    self._stream(model, created, content)
+                    return
+
+                self._send_json(200, {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "logprobs": None,
+                        "finish_reason": "stop"}],
+                    "usage": {
+                        "prompt_tokens": length // 4,
+                        "completion_tokens": len(content) // 4,
+                        "total_tokens": length // 4 + len(content) // 4}})
+
+            def _stream(self, model: str, created: int, content: str):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                chunks = [
+                    {"role": "assistant", "content": content},
+                    {}]
+                for i, delta in enumerate(chunks):
+                    chunk = {
+                        "id": "chatcmpl-mock",
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [{
+                            "index": 0,
+                            "delta": delta,
+                            "finish_reason": "stop" if i == len(chunks) - 1 else None}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    server = MockLLMServer(port=port)
+    print(f"Mock LLM serving on {server.api_base} (chat_model: {server.chat_model})")
+    server._httpd.serve_forever()
@@ -1,20 +1,60 @@
 from synthesize import load_config
-from preprocess import generate_questions
-from survey import AgentResponsePackage
+from preprocess import load_questions
+from survey import AgentResponsePackage, bio_hash
 from pathlib import Path
-from dataclasses import asdict
-import copy
+from journal import read_results_log, load_bios, bios_path
+from matrix import ResponseMatrix
+from functools import cached_property
+import time
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import json
-import re
 import matplotlib.pyplot as plt
 import colorcet as cc
 
+# identifier columns of the results, typed as strings in the spilled chunks
+_ID_COLUMNS = ["agent_id", "serial_number", "bio_hash"]
+
+# response column holding the answers that do not fit the typed column of a chunk
+_TEXT_SUFFIX = "__text"
+
+
 class ProcessSurveyResponse:
-    def __init__(self, config_folder: str, batch_size: int, RUN_FOLDER: str, source: str, date_str: str):
+    def __init__(
+            self,
+            config_folder: str,
+            batch_size: int,
+            RUN_FOLDER: str,
+            source: str,
+            date_str: str,
+            flush_interval: float | None = None,
+            max_buffer_mb: float | None = None):
+        """Survey response postprocessor
+
+        Rows are appended column-wise to a buffer against the fixed synthetic_columns schema
+        and spilled to batch_<n>_<date>_results.parquet chunks every batch_size rows, flush_interval
+        seconds or max_buffer_mb of buffered values, whichever comes first. Nothing else is
+        kept in memory; write_results rebuilds the final results from the spilled chunks
+        and the results log.
+
+        Chunks share an explicit Arrow schema: identifiers are strings, multiple choice answers
+        lists of int64 and other answers int64. Answers that do not fit their column (free text,
+        unparsed lists) are kept as strings in a <col>__text column and merged back on read.
+
+        Args:
+            config_folder (str): path/to/config
+            batch_size (int): rows per flushed chunk
+            RUN_FOLDER (str): run folder
+            source (str): "US" or "FR"
+            date_str (str): run timestamp
+            flush_interval (float | None, optional): Also flush once this many seconds passed since the last flush. Defaults to None.
+            max_buffer_mb (float | None, optional): Also flush once the buffered values reach this size. Defaults to None.
+        """
         self.data_path = Path(config_folder) / "data"
         self.batch_size = batch_size
-        self.n_batches = 0
+        self.flush_interval = flush_interval
+        self.max_buffer_bytes = max_buffer_mb * 1024 * 1024 if max_buffer_mb else None
         self.batches_written = 1
         self.RUN_FOLDER = RUN_FOLDER
         self.source = source
@@ -23,33 +63,74 @@ class ProcessSurveyResponse:
 
     def _prepare_dataset(self):
         if self.source == "US":
-            self.multiple_choice_cols = ["NOGOWHY2", "TRAVELDATAMODE", "DTYPE"]
-            self.ground_truth_df = pd.read_csv(self.data_path / "person.csv", low_memory=False)
+            self.multiple_choice_cols = ["nogowhy2", "traveldatamode", "dtype"] # response cols are lower case
+            ground_truth_cols = pd.read_csv(self.data_path / "person.csv", nrows=0).columns
         else:
             self.multiple_choice_cols = []
             questions_df = pd.read_csv(self.data_path / "../questions.csv", header=None, index_col=0).T
-            self.ground_truth_df = questions_df
-
-        ground_truth_cols = self.ground_truth_df.columns
-        self.synthetic_columns = ["agent_id", "serial_number", "agent_bio", "intro"]
-        self.synthetic_columns.extend(ground_truth_cols)
-        self.synthetic_dataset = pd.DataFrame(columns=self.synthetic_columns)
-        self.batch_dataset = copy.deepcopy(self.synthetic_dataset)
-        self.synthetic_asdict = []
-        self.batch_asdict = []
+            ground_truth_cols = questions_df.columns
+
+        # response columns are logged lower case, keep the schema in the same case
+        self.synthetic_columns = ["agent_id", "serial_number", "bio_hash", "intro"]
+        for col in ground_truth_cols:
+            if col.lower() not in self.synthetic_columns:
+                self.synthetic_columns.append(col.lower())
+
+        self.chunk_schema = self._chunk_schema()
+        self.chunk_paths = []
+        self._reset_buffer()
+
+    def _chunk_schema(self) -> pa.Schema:
+        fields = []
+        for col in self.synthetic_columns:
+            if col in _ID_COLUMNS:
+                fields.append(pa.field(col, pa.string()))
+                continue
+            value_type = pa.list_(pa.int64()) if col in self.multiple_choice_cols else pa.int64()
+            fields.append(pa.field(col, value_type))
+            fields.append(pa.field(col + _TEXT_SUFFIX, pa.string()))
+        return pa.schema(fields)
+
+    def _buffer_table(self) -> pa.Table:
+        """
+        Converts the column buffer to a table of chunk_schema
+        """
+        arrays = []
+        for col in self.synthetic_columns:
+            values = self.buffer[col]
+            if col in _ID_COLUMNS:
+                arrays.append(pa.array([None if val is None else str(val) for val in values], pa.string()))
+                continue
+            multiple_choice = col in self.multiple_choice_cols
+            typed, text = [], []
+            for val in values:
+                if val is None or _fits_column(val, multiple_choice):
+                    typed.append(val)
+                    text.append(None)
+                else:
+                    typed.append(None)
+                    text.append(val if isinstance(val, str) else str(val))
+            arrays.append(pa.array(typed, pa.list_(pa.int64()) if multiple_choice else pa.int64()))
+            arrays.append(pa.array(text, pa.string()))
+        return pa.Table.from_arrays(arrays, schema=self.chunk_schema)
+
+    def _reset_buffer(self):
+        self.buffer = {col: [] for col in self.synthetic_columns}
+        self.buffer_rows = 0
+        self.buffer_bytes = 0
+        self.last_flush = time.time()
 
     def serialize_response(self, agent_response: AgentResponsePackage):
-        response_dict = asdict(agent_response)
-        response_cols = [col.lower() for col in response_dict["logic_flow"]]
+        response_cols = [col.lower() for col in agent_response.logic_flow]
         new_row = {}
 
-        # get agent id and system_message
+        # get agent id and system_message, bios are stored once in the run's bio table
         new_row["agent_id"]       = agent_response.agent_id
         new_row["serial_number"]  = agent_response.serial_number
-        new_row["agent_bio"]      = agent_response.agent_bio
+        new_row["bio_hash"]       = agent_response.bio_hash or bio_hash(agent_response.agent_bio)
 
         # Loop through the logic flow and encoded responses to build the new row
-        for col, val in zip(response_cols, response_dict["encoded_responses"]):
+        for col, val in zip(response_cols, agent_response.encoded_responses):
             # Handle multiple choice columns which might be lists of ints
             if col in self.multiple_choice_cols:
                 if isinstance(val, list):
@@ -66,13 +147,12 @@ class ProcessSurveyResponse:
                 else:
                     new_row[col] = self._coerce_to_int(val)  # Coerce to integer if possible
 
-        # serialize result to dataset
-        self.synthetic_dataset = pd.concat([self.synthetic_dataset, pd.DataFrame([new_row])], ignore_index=True)
-        self.synthetic_asdict.append(response_dict)
-
-        # batch dataset
-        self.batch_dataset = pd.concat([self.batch_dataset, pd.DataFrame([new_row])], ignore_index=True)
-        self.batch_asdict.append(response_dict)
+        # append row to the column buffer
+        for col in self.synthetic_columns:
+            val = new_row.get(col)
+            self.buffer[col].append(val)
+            self.buffer_bytes += _value_bytes(val)
+        self.buffer_rows += 1
 
         self._batch_write_results()
 
@@ -91,52 +171,121 @@ class ProcessSurveyResponse:
             # Return the value as is if it cannot be coerced into an integer
             return value
 
-    def write_results(self, RUN_FOLDER, date_str) -> bool | str:
+    def write_results(self, RUN_FOLDER, date_str, results_log: Path | None = None) -> bool | str:
+        """
+        Writes results.csv from the spilled chunks and, when given the RunJournal results
+        log, results.json from its records. Both are streamed without loading the run.
+        """
         # write csv and json this may fail
         write_success = True
         try:
-            self.synthetic_dataset.to_csv(Path(RUN_FOLDER) / "_".join((date_str, "results.csv")), index=False)
+            self._flush()
+            self._concat_chunks(Path(RUN_FOLDER) / "_".join((date_str, "results.csv")))
         except Exception as e:
             write_success = e
 
-        try:
-            with open(Path(RUN_FOLDER) / "_".join((date_str, "results.json")), "w") as f:
-                json.dump(self.synthetic_asdict, f, indent=4)
-        except Exception as e:
-            write_success = e
-
-        return write_success
-
-    def _batch_write_results(self) -> None:
-        # write csv and json this may fail
-        if self.n_batches % self.batch_size == 0:
+        if results_log is not None:
             try:
-                self.batch_dataset.to_csv(Path(self.RUN_FOLDER) / f"batch_{self.batches_written}_{self.date_str}_results.csv", index=False)
+                self._log_to_json(results_log, Path(RUN_FOLDER) / "_".join((date_str, "results.json")))
             except Exception as e:
-                print(e)
+                write_success = e
 
-            try:
-                with open(Path(self.RUN_FOLDER) / f"batch_{self.batches_written}_{self.date_str}_results.json", "w") as f:
-                    json.dump(self.batch_asdict, f, indent=4)
-            except Exception as e:
-                print(e)
+        return write_success
 
-            # reset batch datasets
-            self.batches_written += 1
-            self.batch_dataset = self.batch_dataset[0:0]
-            self.batch_asdict = []
+    def _log_to_json(self, results_log: Path, results_path: Path) -> None:
+        """
+        Streams the records of a results log into an indented JSON array
+        """
+        with open(results_path, "w") as out:
+            out.write("[")
+            for i, record in enumerate(read_results_log(results_log)):
+                out.write(",\n" if i else "\n")
+                out.write(json.dumps(record, indent=4))
+            out.write("\n]")
+
+    def _concat_chunks(self, results_path: Path) -> None:
+        """
+        Streams the flushed chunks into one csv, one chunk in memory at a time. The header
+        is written once.
+        """
+        with open(results_path, "w", newline="") as out:
+            out.write(",".join(self.synthetic_columns) + "\n")
+            for chunk_path in self.chunk_paths:
+                read_chunk(chunk_path)[self.synthetic_columns].to_csv(out, header=False, index=False)
 
-        # iterate n_batches written
-        self.n_batches += 1
+    def _batch_write_results(self) -> None:
+        # flush on size or time threshold
+        due = self.buffer_rows >= self.batch_size
+        if self.max_buffer_bytes is not None:
+            due = due or self.buffer_bytes >= self.max_buffer_bytes
+        if self.flush_interval is not None:
+            due = due or (time.time() - self.last_flush) >= self.flush_interval
+        if due:
+            self._flush()
+
+    def _flush(self) -> None:
+        """
+        Spills the buffer to the next chunk. A failed write raises and keeps the buffer,
+        so its rows go out with the next flush.
+        """
+        if self.buffer_rows == 0:
+            return
+
+        chunk_path = Path(self.RUN_FOLDER) / f"batch_{self.batches_written}_{self.date_str}_results.parquet"
+        tmp_path = chunk_path.with_suffix(".tmp")
+        pq.write_table(self._buffer_table(), tmp_path)
+        tmp_path.replace(chunk_path)
+        self.chunk_paths.append(chunk_path)
+
+        # reset batch buffer
+        self.batches_written += 1
+        self._reset_buffer()
+
+
+def _value_bytes(value) -> int:
+    """
+    Rough buffered size of a response: string length, 8 bytes a number, summed over list answers
+    """
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, list):
+        return sum(_value_bytes(x) or 8 for x in value)
+    return 8
+
+
+def _fits_column(value, multiple_choice: bool) -> bool:
+    if multiple_choice:
+        return isinstance(value, list) and all(isinstance(x, int) and not isinstance(x, bool) for x in value)
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def read_chunk(chunk_path: str | Path) -> pd.DataFrame:
+    """
+    Reads a spilled results chunk, answers kept as text are merged back into their column
+    """
+    table = pq.read_table(chunk_path)
+    frame = {}
+    for col in table.column_names:
+        if col.endswith(_TEXT_SUFFIX):
+            continue
+        values = table[col].to_pylist()
+        if col + _TEXT_SUFFIX in table.column_names:
+            text = table[col + _TEXT_SUFFIX].to_pylist()
+            values = [t if val is None else val for val, t in zip(values, text)]
+        frame[col] = values
+    return pd.DataFrame(frame, dtype=object)
 
 
 class ResultsWriter:
-    def __init__(self, config_folder: str, RUN_FOLDER: str, source:str="US"):
+    def __init__(self, config_folder: str, RUN_FOLDER: str, source:str="US", load_bios: bool = False):
         self.config_folder = config_folder
         self.data_path = Path(config_folder) / "data"
         self.RUN_PATH = Path(RUN_FOLDER)
         self.source = source
-        _, _, _, self.analysis_conf = load_config(config_folder=config_folder)
+        self.load_bios = load_bios
+        _, _, self.survey_conf, self.analysis_conf = load_config(config_folder=config_folder)
         self._load_datasets()
         self._clean_test_datasets()
         self._set_plotting_format()
@@ -147,41 +296,77 @@ class ResultsWriter:
         SEP = "_"
         self.timestamp = SEP.join(self.RUN_PATH.name.split(SEP)[-2:])
 
+        # prefer the compact response matrix, built from the results log and kept once the sim is complete
+        matrix_path = self.RUN_PATH / (self.timestamp+"_responses.npz")
+        results_logs = list(self.RUN_PATH.glob(self.timestamp+"_results.jsonl*"))
+        complete = any(self.RUN_PATH.glob(self.timestamp+"_results.csv"))
+        multiple_choice = self.analysis_conf.get("multiple_choice", [])
+        if matrix_path.exists():
+            self.test_dataset = ResponseMatrix.load(matrix_path).to_frame(multiple_choice=multiple_choice)
+        elif results_logs:
+            matrix = ResponseMatrix.from_results_log(results_logs[0])
+            if complete:
+                matrix.save(matrix_path)
+            self.test_dataset = matrix.to_frame(multiple_choice=multiple_choice)
         # check if sim is complete
-        if any(self.RUN_PATH.glob(self.timestamp+"_results.*")):
+        elif complete:
             self.test_dataset = pd.read_csv(self.RUN_PATH / (self.timestamp+"_results.csv"))
         else:
-            batches = self.RUN_PATH.glob("batch_*_results.csv")
-            self.test_dataset = pd.concat([pd.read_csv(batch) for batch in batches], ignore_index=True)
+            batches = sorted(self.RUN_PATH.glob("batch_*_results.parquet"), key=lambda path: int(path.name.split("_")[1]))
+            self.test_dataset = pd.concat([read_chunk(batch) for batch in batches], ignore_index=True)
+
+        # join bios back from the run's bio table only when asked
+        if self.load_bios and "bio_hash" in self.test_dataset.columns:
+            bios = load_bios(bios_path(self.RUN_PATH, self.timestamp))
+            self.test_dataset.insert(
+                self.test_dataset.columns.get_loc("bio_hash") + 1,
+                "agent_bio",
+                self.test_dataset["bio_hash"].map(bios))
 
         # load true dataset
         if self.source == "US":
             self.true_dataset = pd.read_csv(self.data_path / "person.csv", low_memory=False)
 
+    @cached_property
+    def questions(self) -> dict:
+        """
+        Survey question catalog, only built when figures need the response labels
+        """
+        return load_questions(config_folder=self.config_folder, source=self.source)
+
     def _clean_test_datasets(self):
         """
-        This is a bad work around fix to properly format bad LLM responses. Need to fix this eventually.
+        Formats bad LLM responses: every survey variable except multiple choice and excluded
+        ones is reduced to the first integer found in its text and typed as Int64. Text cells
+        of all those columns are cleaned in one vectorized pass.
         """
-        # get survey variables
-        self.questions = generate_questions(config_folder=self.config_folder)
-        self.survey_vars = list(self.questions.keys())
+        # get survey variables from the survey logic
+        self.survey_vars = list(self.survey_conf.get("logic").keys())
         self.survey_vars_lower = [var.lower() for var in self.survey_vars]
 
         # drop all Nan cols
         self.test_dataset = self.test_dataset.dropna(axis=1, how="all")
 
         # convert all cols to int except multiple choice cols
-        multiple_choice_cols_lower = [var.lower() for var in self.analysis_conf.get("multiple_choice")]
-        exclude_cols_lower = [var.lower() for var in self.analysis_conf.get("exclude")]
-        test_cols = self.test_dataset.columns
-        int_cols = []
-        for col in test_cols:
-            if \
-                col in self.survey_vars_lower and \
-                col not in multiple_choice_cols_lower and \
-                col not in exclude_cols_lower:
-                    int_cols.append(col)
-                    self.test_dataset[col] = self.test_dataset[col].apply(_extract_first_int)
+        multiple_choice_cols_lower = {var.lower() for var in self.analysis_conf.get("multiple_choice")}
+        exclude_cols_lower = {var.lower() for var in self.analysis_conf.get("exclude")}
+        int_cols = [
+            col for col in self.test_dataset.columns
+            if col in self.survey_vars_lower
+            and col not in multiple_choice_cols_lower
+            and col not in exclude_cols_lower]
+
+        # only object columns can hold text, stack them and extract the first integer of every text cell
+        text_cols = [col for col in int_cols if self.test_dataset[col].dtype == object]
+        if text_cols:
+            text = self.test_dataset[text_cols]
+            cells = pd.Series(text.to_numpy().ravel())
+            is_str = cells.map(type).eq(str)
+            if is_str.any():
+                cells = cells.mask(is_str, cells[is_str].str.extract(r"(\d+)", expand=False))
+            cells = pd.to_numeric(cells, errors="coerce")
+            self.test_dataset[text_cols] = pd.DataFrame(
+                cells.to_numpy().reshape(text.shape), index=text.index, columns=text_cols)
         self.test_dataset[int_cols] = self.test_dataset[int_cols].astype("Int64")
 
     def _group_dataset(self, var: str, dataset: pd.DataFrame) -> pd.DataFrame:
@@ -245,16 +430,6 @@ class ResultsWriter:
         plt.tight_layout()
 
 
-def _extract_first_int(x):
-    if isinstance(x, str):
-        m = re.search(r"\d+", x)
-        if m:
-            return int(m.group ())
-        else:
-            return None
-    return x
-
-
 def main():
     pass
 
@@ -1,4 +1,4 @@
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple, Iterator
 import pandas as pd
 import geopandas as gpd
 import random
@@ -7,6 +7,10 @@ from pathlib import Path
 import json
 import re
 import locale
+import pickle
+import hashlib
+import multiprocessing
+import multiprocessing.pool
 
 """
 Preprocessing steps for census and travel survey data.
@@ -19,53 +23,92 @@ that needs to be done manually.
 locale.setlocale(locale.LC_ALL, "en_US.UTF-8") # this will be a problem in the future
 
 
-def process_MyDailyTravelData(config_folder: str):
-    def value_to_int(x):
-        try:
-            return int(x)
-        except:
-            return int(x.split("-")[0])
-
-    def clean_and_replace(text: str, replacements: dict) -> str:
-
-        text = " ".join(text.split())  # Remove excess whitespace and new lines
-
-        def replace_match(match):
-            key = match.group(1)
-            return replacements.get(key, match.group(0))  # Replace if found, else keep original
-
-        return re.sub(r"\[\$(.*?)\]", replace_match, text)
-
-    replacement_dict = {
-        "AGE_COMPUTED": "",
-        "ARE_YOU": "are you",
-        "ARE_YOU_CAP": "Are you",
-        "CURRENTDATE": "today",
-        "DAYCARE": "",
-        "DO_YOU": "do you",
-        "DO_YOU_CAP": "Do you",
-        "HAVE_YOU": "have you",
-        "I_DO": "I do",
-        "JOBTEXT": "",
-        "NONWORKER_TEXT": "",
-        "ON_DAY": "today",
-        "PRIMARY": " primary",
-        "WERE_ACTIVITIES": "Were activities",
-        "WORK_PRE": "",
-        "WORKER_TEXT": "",
-        "YOUR": "your",
-        "YOUR1": "your",
-        "YOUR_EMPLOYER": "your employer",
-        "YOUR_THEIR": "your",
-        "YOU": "you",
-        "YOU1": "you",
-        "YOU_DO": "you do",
-        "YOU_HAVE": "you",
-        "YOU_TELECOMMUTE": "you telecommute",
-        "YOU_THEIR": "your",
-        "YOU_WORK": "you work"
-    }
+_MDT_REPLACEMENTS = {
+    "AGE_COMPUTED": "",
+    "ARE_YOU": "are you",
+    "ARE_YOU_CAP": "Are you",
+    "CURRENTDATE": "today",
+    "DAYCARE": "",
+    "DO_YOU": "do you",
+    "DO_YOU_CAP": "Do you",
+    "HAVE_YOU": "have you",
+    "I_DO": "I do",
+    "JOBTEXT": "",
+    "NONWORKER_TEXT": "",
+    "ON_DAY": "today",
+    "PRIMARY": " primary",
+    "WERE_ACTIVITIES": "Were activities",
+    "WORK_PRE": "",
+    "WORKER_TEXT": "",
+    "YOUR": "your",
+    "YOUR1": "your",
+    "YOUR_EMPLOYER": "your employer",
+    "YOUR_THEIR": "your",
+    "YOU": "you",
+    "YOU1": "you",
+    "YOU_DO": "you do",
+    "YOU_HAVE": "you",
+    "YOU_TELECOMMUTE": "you telecommute",
+    "YOU_THEIR": "your",
+    "YOU_WORK": "you work"
+}
+_MDT_PLACEHOLDER = re.compile(r"\[\$(.*?)\]")
+
+
+def _clean_and_replace(text: str, replacements: dict = _MDT_REPLACEMENTS) -> str:
+    """
+    Collapses whitespace and fills [$PLACEHOLDER] tokens of a question text
+    """
+    text = " ".join(text.split())  # Remove excess whitespace and new lines
+    return _MDT_PLACEHOLDER.sub(lambda match: replacements.get(match.group(1), match.group(0)), text)
+
+
+def _value_to_int(x):
+    try:
+        return int(x)
+    except:
+        return int(x.split("-")[0])
+
+
+def _build_query_dictionary(variables_df: pd.DataFrame, lookup_df: pd.DataFrame, person_cols: List[str]) -> dict:
+    """Builds the MyDailyTravel question catalog
+
+    Variable metadata is indexed by NAME and lookup values are grouped by NAME once, so
+    every person.csv column is a dictionary lookup.
+
+    Args:
+        variables_df (pd.DataFrame): "Variables" sheet of the data dictionary with question text
+        lookup_df (pd.DataFrame): "Value Lookup" sheet of the data dictionary with VALUE_INT
+        person_cols (List[str]): columns of person.csv
+    """
+    names = {col.upper() for col in person_cols}
+
+    # first question text and data type of every variable
+    variables = variables_df[variables_df["NAME"].isin(names)].drop_duplicates("NAME").set_index("NAME")
+    questions = variables["QUESTION TEXT"].to_dict()
+    dtypes = variables["DATA TYPE"].to_dict()
+
+    # value labels of every variable, later duplicate values win as in a dict
+    lookup_df = lookup_df[lookup_df["NAME"].isin(questions.keys())]
+    responses = {
+        name: dict(zip(group["VALUE_INT"], group["LABEL"]))
+        for name, group in lookup_df.groupby("NAME", sort=False)}
+
+    # query dictionary
+    query_dictionary = {}
+    for col in person_cols:
+        name = col.upper()
+        if name in questions:
+            query_dictionary[name] = {
+                "question": _clean_and_replace(questions[name]),
+                "dtype": dtypes[name],
+                "response": responses.get(name, {})
+            }
+
+    return query_dictionary
 
+
+def process_MyDailyTravelData(config_folder: str):
     # get variables and table from data dictionary
     data_path = Path(config_folder) / "data"
     file_path = data_path / "data_dictionary.xlsx"
@@ -74,33 +117,14 @@ def process_MyDailyTravelData(config_folder: str):
     variables_df = variables_df[variables_df["QUESTION TEXT"].notna()]
 
     lookup_df = data_dictionary["Value Lookup"]
-    lookup_df["VALUE_INT"] = lookup_df["VALUE"].apply(
-        lambda x: value_to_int(x)
-        )
+    lookup_df["VALUE_INT"] = lookup_df["VALUE"].apply(_value_to_int)
 
     # get response dictionary from person.csv
     file_path = data_path / "person.csv"
     person_cols = pd.read_csv(file_path, nrows=0).columns.to_list()
 
     # query dictionary
-    query_dictionary = {}
-    for col in person_cols:
-        if col.upper() in variables_df["NAME"].to_list():
-            try:
-                lookup_table = lookup_df[lookup_df["NAME"]==col.upper()]
-                query_dictionary[col.upper()] = {
-                    "question":(variables_df[variables_df["NAME"] == col.upper()]["QUESTION TEXT"].values)[0],
-                    "dtype":(variables_df[variables_df["NAME"] == col.upper()]["DATA TYPE"].values)[0],
-                    "response": lookup_table.set_index("VALUE_INT")["LABEL"].to_dict()
-                }
-            except:
-                query_dictionary[col.upper()] = "This didnt work"
-
-    for item in query_dictionary.items():
-        survey_variable, question_response = item
-        if "question" in question_response.keys():
-            question_text = query_dictionary[survey_variable]["question"]
-            query_dictionary[survey_variable]["question"] = clean_and_replace(question_text, replacement_dict)
+    query_dictionary = _build_query_dictionary(variables_df, lookup_df, person_cols)
 
     # add introduction
     introduction = {"INTRO":{
@@ -133,19 +157,19 @@ def process_pums_data(config_folder: str, person: bool = True, write: str | None
     df = pd.read_csv(*df_path, nrows=1)
     pums_variables = df.columns.values
     pums_variable_dict = {k:v for k,v in variable_desc.items() if k in pums_variables}
+
+    # value rows of every variable in one grouped pass
+    values = dd[(dd.a != "NAME") & dd.b.isin(pums_variable_dict.keys())]
+    values = values.assign(f=values.f.fillna(na_str), g=values.g.fillna(na_str))
+    groups = dict(tuple(values.groupby("b", sort=False)))
+
     mapper = {}
     for variable,description in pums_variable_dict.items():
-        description_row = dd[(dd.a!="NAME") & (dd.b==variable)]
-        dtype = description_row.c.iloc[0]
-        answers = description_row[["f","g"]] \
-            .drop_duplicates() \
-            .fillna(na_str) \
-            .set_index("f")["g"] \
-            .to_dict()
+        description_row = groups[variable]
         mapper[variable] = {
             "description": description,
-            "dtype": dtype,
-            "answers": answers
+            "dtype": description_row.c.iloc[0],
+            "answers": dict(zip(description_row.f, description_row.g))
         }
 
     if write != None:
@@ -155,11 +179,7 @@ def process_pums_data(config_folder: str, person: bool = True, write: str | None
         return mapper
 
 
-def puma_locations(config_folder: str) -> Dict[str, List[str]]:
-    """
-    returns a dictionary of PUMA codes keys and list of cities within PUMA.
-    derived from:https://catalog.data.gov/dataset/tiger-line-shapefile-2019-state-illinois-current-place-state-based
-    """
+def _build_puma_locations(config_folder: str) -> Dict[str, List[str]]:
     epsg = 26971 # NAD83 StatePlane Illinois East FIPS 1201
     data_path = Path(config_folder) / "data"
     puma = gpd.read_file(data_path / "tl_2019_17_puma10.shp").to_crs(epsg=epsg)
@@ -172,6 +192,119 @@ def puma_locations(config_folder: str) -> Dict[str, List[str]]:
     return puma_locations
 
 
+def _build_cmap_pumas(config_folder: str) -> List[str]:
+    data_path = Path(config_folder) / "data"
+    puma_gdf = gpd.read_file(data_path / "tl_2019_17_puma10.shp")
+    cmap_gdf = gpd.read_file(data_path / "Facility_Planning_Areas_2016.shp")
+
+    # get puma areas within cmap planning boundary
+    cmap_gdf.to_crs(puma_gdf.crs, inplace=True)
+    cmap_boundary = cmap_gdf.geometry.union_all()
+    return puma_gdf[puma_gdf.geometry.intersects(cmap_boundary)]["PUMACE10"].to_list()
+
+
+def _build_puma_geometries(config_folder: str, crs: str) -> gpd.GeoDataFrame:
+    return gpd.read_file(Path(config_folder) / "data" / "tl_2019_17_puma10.shp").to_crs(crs=crs)
+
+
+def _shapefile_sources(config_folder: str, *shapefiles: str) -> List[Path]:
+    """
+    Every sidecar file (.shp, .dbf, .shx, .prj, ...) of the given shapefiles
+    """
+    data_path = Path(config_folder) / "data"
+    return sorted(path for shapefile in shapefiles for path in data_path.glob(Path(shapefile).stem + ".*"))
+
+
+def puma_locations(config_folder: str) -> Dict[str, List[str]]:
+    """
+    returns a dictionary of PUMA codes keys and list of cities within PUMA.
+    derived from:https://catalog.data.gov/dataset/tiger-line-shapefile-2019-state-illinois-current-place-state-based
+    The nearest PUMA join is cached as JSON in the config cache.
+    """
+    return cached_artifact(
+        config_folder,
+        "puma_places",
+        _shapefile_sources(config_folder, "tl_2019_17_puma10.shp", "tl_2019_17_place.shp"),
+        _build_puma_locations,
+        config_folder=config_folder,
+        fmt="json")
+
+
+def cmap_pumas(config_folder: str) -> List[str]:
+    """
+    returns the PUMACE10 codes of PUMA areas intersecting the CMAP planning boundary.
+    derived from: https://datahub.cmap.illinois.gov/datasets/4834d52310d24e56a0300898a0cb23bc_0/explore
+    """
+    return cached_artifact(
+        config_folder,
+        "cmap_pumas",
+        _shapefile_sources(config_folder, "tl_2019_17_puma10.shp", "Facility_Planning_Areas_2016.shp"),
+        _build_cmap_pumas,
+        config_folder=config_folder,
+        fmt="json")
+
+
+def puma_geometries(config_folder: str, crs: str = "EPSG:4326") -> gpd.GeoDataFrame:
+    """
+    returns the 2019 TIGER PUMA areas reprojected to crs, cached as GeoParquet
+    """
+    return cached_artifact(
+        config_folder,
+        f"puma_geometries_{crs.replace(':', '')}",
+        _shapefile_sources(config_folder, "tl_2019_17_puma10.shp"),
+        _build_puma_geometries,
+        config_folder=config_folder,
+        crs=crs,
+        fmt="geoparquet")
+
+
+def _build_population_store(config_folder: str) -> pd.DataFrame:
+    data_path = Path(config_folder) / "data/populationsim"
+    popsim_serialnos = pd.read_csv(data_path / "output/synthetic_persons.csv", usecols=["SERIALNO"], dtype=str).SERIALNO.unique()
+    pums_df = pd.read_csv(data_path / "data/pums_person_chicago.csv", dtype=str)
+
+    # PUMS persons of the synthetic population, typed keys and sorted by STPUMA
+    pums_df = pums_df[pums_df.SERIALNO.isin(popsim_serialnos)]
+    pums_df = pums_df.astype({"STPUMA": "int32", "AGEP": "int16"})
+
+    # coded attributes are stored dictionary encoded and read back as categoricals
+    pums_df = pums_df.astype({col: "category" for col in pums_df.columns if col != "SERIALNO" and pums_df[col].dtype == object})
+    return pums_df.sort_values("STPUMA", kind="stable").reset_index(drop=True)
+
+
+def _build_popsim_counts(config_folder: str) -> Dict[str, int]:
+    popsim_df = pd.read_csv(Path(config_folder) / "data/populationsim/output/synthetic_persons.csv", usecols=["STPUMA"])
+    return {str(stpuma): int(count) for stpuma, count in popsim_df.groupby("STPUMA").size().items()}
+
+
+def population_store(config_folder: str) -> Path:
+    """
+    Parquet store of the PUMS persons in the populationsim synthetic population, sorted by STPUMA
+    with integer STPUMA and AGEP so reads can be filtered by area and age, and categorical attributes.
+    """
+    data_path = Path(config_folder) / "data/populationsim"
+    return cached_artifact_path(
+        config_folder,
+        "population_store",
+        [data_path / "output/synthetic_persons.csv", data_path / "data/pums_person_chicago.csv"],
+        _build_population_store,
+        config_folder=config_folder,
+        fmt="parquet")
+
+
+def popsim_counts(config_folder: str) -> Dict[str, int]:
+    """
+    Synthetic population totals by STPUMA
+    """
+    return cached_artifact(
+        config_folder,
+        "popsim_counts",
+        [Path(config_folder) / "data/populationsim/output/synthetic_persons.csv"],
+        _build_popsim_counts,
+        config_folder=config_folder,
+        fmt="json")
+
+
 def attribute_decoder_dict(encoded_attributes: Dict[str, str], decoder_dict: Dict[Any, Any]) -> Dict[str, str]:
     """
     prepares a dictionary of encoded individual attributes and their
@@ -191,6 +324,29 @@ def attribute_decoder_dict(encoded_attributes: Dict[str, str], decoder_dict: Dic
     return individual_attributes
 
 
+def attribute_decoder_frame(population: pd.DataFrame, decoder_dict: Dict[Any, Any]) -> pd.DataFrame:
+    """
+    Decodes a whole encoded population column by column with the same rules as attribute_decoder_dict:
+    attributes missing from decoder_dict are "MISSING", numeric attributes and SERIALNO/PUMA keep
+    their raw values, and coded attributes map to their answer labels or "MISSING".
+    """
+    keyCatch = ["SERIALNO", "PUMA"]
+    decoded = {}
+    for key in population.columns:
+        decoder = decoder_dict.get(key)
+        if not isinstance(decoder, dict) or "dtype" not in decoder:
+            decoded[key] = pd.Series("MISSING", index=population.index, dtype=object)
+        elif (decoder["dtype"] == "N") or (key in keyCatch):
+            decoded[key] = population[key].astype(object)
+        elif not isinstance(decoder.get("answers"), dict):
+            decoded[key] = pd.Series("MISSING", index=population.index, dtype=object)
+        else:
+            answers = decoder["answers"]
+            column = population[key]
+            decoded[key] = column.map(answers).astype(object).where(column.isin(list(answers)), "MISSING")
+    return pd.DataFrame(decoded, index=population.index)
+
+
 def get_attribute_descriptions(decoder_dict: Dict[Any, Any]) -> Dict[str, str]:
     return {key+"_desc": decoder_dict[key]["description"] for key in decoder_dict.keys()}
 
@@ -305,31 +461,55 @@ def process_insee_census(config_folder):
     df_path = data_path / "varmod_indcvi_2021.csv"
     df = pd.read_csv(df_path, sep=";")
 
-    insee_variables = df.COD_VAR.unique()
+    # first row of every variable holds its description, all rows its answers
+    descriptions = df.drop_duplicates("COD_VAR").set_index("COD_VAR")
 
     mapper = {}
-    for var in insee_variables:
-
-        # get variable description
-        filtered_df = df[df.COD_VAR==var]
-        row_match = filtered_df.iloc[0]
-        description = row_match.LIB_VAR
-        dtype = row_match.TYPE_VAR
-
-        answers = dict(zip(
-            filtered_df["COD_MOD"],
-            filtered_df["LIB_MOD"]
-        ))
-
+    for var, filtered_df in df.groupby("COD_VAR", sort=False):
         mapper[var] = {
-            "description": description,
-            "dtype": dtype,
-            "answers": answers
+            "description": descriptions.at[var, "LIB_VAR"],
+            "dtype": descriptions.at[var, "TYPE_VAR"],
+            "answers": dict(zip(
+                filtered_df["COD_MOD"],
+                filtered_df["LIB_MOD"]
+            ))
         }
 
     return mapper
 
 
+def load_pums_data(config_folder: str, person: bool = True) -> dict:
+    """
+    Attribute decoder of process_pums_data, cached per version of the PUMS data dictionary
+    and header of the PUMS file
+    """
+    data_path = Path(config_folder) / "data"
+    df_path = next(data_path.glob("psam_p*.csv" if person else "psam_h*.csv"), None)
+    header = b""
+    if df_path is not None:
+        with open(df_path, "rb") as f:
+            header = f.readline()
+    return cached_artifact(
+        config_folder,
+        "pums_person" if person else "pums_household",
+        [*data_path.glob("PUMS_Data_Dictionary*.csv"), header],
+        process_pums_data,
+        config_folder=config_folder,
+        person=person)
+
+
+def load_insee_census(config_folder: str) -> dict:
+    """
+    Attribute decoder of process_insee_census, cached per version of the INSEE data description
+    """
+    return cached_artifact(
+        config_folder,
+        "insee_census",
+        [Path(config_folder) / "data" / "varmod_indcvi_2021.csv"],
+        process_insee_census,
+        config_folder=config_folder)
+
+
 def generate_questions(config_folder: str, source: str = "US"):
     if source == "US":
         return process_MyDailyTravelData(config_folder=config_folder)
@@ -337,6 +517,136 @@ def generate_questions(config_folder: str, source: str = "US"):
         return process_EnqueteMenagesDeplacements(config_folder=config_folder)
 
 
+def _question_sources(config_folder: str, source: str = "US") -> List[Path]:
+    data_path = Path(config_folder) / "data"
+    if source == "US":
+        return [data_path / "data_dictionary.xlsx", data_path / "person.csv"]
+    elif source == "FR":
+        return [
+            data_path / "Dessin_fichier_Dictionnaire_variables_EDGT_AML_Face-a-Face_02082015.xls",
+            Path(config_folder) / "questions.csv"]
+    return []
+
+
+def _hash_sources(sources: List[Path | bytes]) -> str:
+    """
+    sha256 over the path, size and modification time of the source files and of this module,
+    bytes sources (file headers) are hashed as is. Sources are never read, so checking the
+    cache stays cheap on multi-GB census files.
+    """
+    digest = hashlib.sha256()
+    for path in [Path(__file__), *sources]:
+        if isinstance(path, bytes):
+            digest.update(path)
+            continue
+        digest.update(str(path.resolve()).encode("utf-8"))
+        if not path.exists():
+            continue
+        stat = path.stat()
+        digest.update(f"{stat.st_size}|{stat.st_mtime_ns}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _read_pickle(path: Path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def _write_pickle(artifact, path: Path) -> None:
+    with open(path, "wb") as f:
+        pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _read_json(path: Path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write_json(artifact, path: Path) -> None:
+    with open(path, "w") as f:
+        json.dump(artifact, f)
+
+
+# parquet row groups stay small so filtered reads of a sorted store skip most of the file
+_ROW_GROUP_SIZE = 50_000
+
+# suffix, reader and writer of every artifact format
+_ARTIFACT_FORMATS = {
+    "pickle": (".pkl", _read_pickle, _write_pickle),
+    "json": (".json", _read_json, _write_json),
+    "parquet": (".parquet", pd.read_parquet, lambda artifact, path: artifact.to_parquet(path, index=False, row_group_size=_ROW_GROUP_SIZE)),
+    "geoparquet": (".parquet", gpd.read_parquet, lambda artifact, path: artifact.to_parquet(path)),
+}
+
+
+def _artifact_path(config_folder: str, name: str, sources: List[Path | bytes], fmt: str) -> Path:
+    suffix, _, _ = _ARTIFACT_FORMATS[fmt]
+    return Path(config_folder) / "cache" / f"{name}_{_hash_sources(sources)[:16]}{suffix}"
+
+
+def _write_artifact(artifact, cache_path: Path, name: str, fmt: str) -> None:
+    """
+    Atomically writes an artifact to cache_path and removes its stale versions
+    """
+    suffix, _, write = _ARTIFACT_FORMATS[fmt]
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    for stale_path in cache_path.parent.glob(f"{name}_{'?' * 16}{suffix}"):
+        stale_path.unlink(missing_ok=True)
+    tmp_path = cache_path.with_suffix(".tmp")
+    write(artifact, tmp_path)
+    tmp_path.replace(cache_path)
+
+
+def cached_artifact(config_folder: str, name: str, sources: List[Path | bytes], build, *args, fmt: str = "pickle", **kwargs):
+    """Loads a preprocessing artifact from the config cache or builds it
+
+    The artifact is written to config/cache/<name>_<hash>.<fmt suffix>, keyed by a hash of its
+    source files, so it is rebuilt once the sources change. Stale versions of the artifact are removed.
+
+    Args:
+        config_folder (str): path/to/config
+        name (str): artifact name
+        sources (List[Path | bytes]): files, or raw bytes such as a header, the artifact is built from
+        build (Callable): builds the artifact from *args and **kwargs
+        fmt (str, optional): "pickle", "json", "parquet" or "geoparquet". Defaults to "pickle".
+    """
+    _, read, _ = _ARTIFACT_FORMATS[fmt]
+    cache_path = _artifact_path(config_folder, name, sources, fmt)
+    if cache_path.exists():
+        try:
+            return read(cache_path)
+        except (pickle.UnpicklingError, EOFError, AttributeError, ValueError, OSError):
+            pass
+
+    artifact = build(*args, **kwargs)
+    _write_artifact(artifact, cache_path, name, fmt)
+    return artifact
+
+
+def cached_artifact_path(config_folder: str, name: str, sources: List[Path | bytes], build, *args, fmt: str = "parquet", **kwargs) -> Path:
+    """
+    Like cached_artifact, but only makes sure the artifact is built and returns its path,
+    for artifacts that are read partially such as filtered parquet reads
+    """
+    cache_path = _artifact_path(config_folder, name, sources, fmt)
+    if not cache_path.exists():
+        _write_artifact(build(*args, **kwargs), cache_path, name, fmt)
+    return cache_path
+
+
+def load_questions(config_folder: str, source: str = "US") -> dict:
+    """
+    Question catalog of generate_questions, compiled once per version of the data dictionary
+    """
+    return cached_artifact(
+        config_folder,
+        f"questions_{source}",
+        _question_sources(config_folder, source),
+        generate_questions,
+        config_folder=config_folder,
+        source=source)
+
+
 def _decapitalize(sentence: str)->str:
     """
     Returns sentence without capitalization
@@ -458,6 +768,8 @@ class SystemMessageGenerator:
         """
         WRAP IS DEFAULT BEHAVIOR ON SYS MSG
         """
+        self.config_folder = config_folder
+
         # load environment
         self.env = Environment(
             loader=FileSystemLoader(
@@ -524,6 +836,92 @@ class SystemMessageGenerator:
         else:
             return rendered_msg[1:] # there is an extra space on intro to make shuffling work
 
+    def write_seeded_system_message(self, seed: int, **kwargs) -> str:
+        """
+        Writes an agent system message with the template filters' random draws seeded by seed.
+        The global random state is restored afterwards.
+        """
+        state = random.getstate()
+        try:
+            random.seed(seed)
+            return self.write_system_message(**kwargs)
+        finally:
+            random.setstate(state)
+
+    def render_pool(self, processes: int, **shared_kwargs) -> multiprocessing.pool.Pool:
+        """
+        Pool of render workers sharing shared_kwargs. Workers are spawned rather than forked,
+        the parent already runs threads (endpoint probes, the mock server) that fork would copy
+        mid-flight.
+        """
+        return multiprocessing.get_context("spawn").Pool(
+            processes=processes,
+            initializer=_init_render_worker,
+            initargs=(self.config_folder, self.template, self.verbose_debug, self.shuffle, self.wrap, shared_kwargs))
+
+    def submit_system_messages(
+            self,
+            pool: multiprocessing.pool.Pool,
+            records: List[Dict[str, Any]],
+            seeds: List[int],
+            chunksize: int = 64) -> Iterator[str]:
+        """
+        Starts rendering records on a pool from render_pool and returns right away. The
+        workers keep rendering while the caller does other work, iterating the result yields
+        the system messages in order, waiting only on those not rendered yet.
+        """
+        return pool.imap(_render_worker, zip(records, seeds), chunksize=chunksize)
+
+    def write_system_messages(
+            self,
+            records: List[Dict[str, Any]],
+            seeds: List[int],
+            processes: int | None = None,
+            chunksize: int = 64,
+            pool: multiprocessing.pool.Pool | None = None,
+            **shared_kwargs) -> List[str]:
+        """Writes the system messages of a whole population
+
+        Record i is rendered with seed seeds[i], so the output is the same in order and content
+        whether rendered sequentially or across a process pool. Each worker compiles the Jinja
+        environment once and receives shared_kwargs once, records are sent in chunks.
+
+        Args:
+            records (List[Dict[str, Any]]): decoded attributes of every agent
+            seeds (List[int]): render seed of every agent
+            processes (int | None, optional): Render across this many worker processes, None or 1
+                renders in this process. Defaults to None.
+            chunksize (int, optional): Records sent to a worker at a time. Defaults to 64.
+            pool (multiprocessing.pool.Pool | None, optional): Open pool from render_pool to render
+                with, shared_kwargs are then the ones it was created with. Defaults to None.
+            shared_kwargs: template kwargs shared by every agent (attribute descriptions, ploc, ...)
+
+        Returns:
+            List[str]: system message of every record
+        """
+        if pool is not None:
+            return list(self.submit_system_messages(pool, records, seeds, chunksize=chunksize))
+
+        if processes is None or processes <= 1 or len(records) <= chunksize:
+            return [self.write_seeded_system_message(seed, **record, **shared_kwargs) for record, seed in zip(records, seeds)]
+
+        with self.render_pool(processes, **shared_kwargs) as pool:
+            return list(pool.imap(_render_worker, zip(records, seeds), chunksize=chunksize))
+
+
+# system message generator and shared template kwargs of a render worker process
+_RENDER_WORKER = {}
+
+
+def _init_render_worker(config_folder: str, template: str, verbose_debug: bool, shuffle: bool, wrap: int | None, shared_kwargs: Dict[str, Any]) -> None:
+    _RENDER_WORKER["generator"] = SystemMessageGenerator(config_folder, template, verbose_debug=verbose_debug, shuffle=shuffle, wrap=wrap)
+    _RENDER_WORKER["shared_kwargs"] = shared_kwargs
+
+
+def _render_worker(task: Tuple[Dict[str, Any], int]) -> str:
+    record, seed = task
+    return _RENDER_WORKER["generator"].write_seeded_system_message(seed, **record, **_RENDER_WORKER["shared_kwargs"])
+
 
 if __name__ == "__main__":
     pass
\ No newline at end of file
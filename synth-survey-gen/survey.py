@@ -1,16 +1,18 @@
 from preprocess import *
 from langroid.language_models import LLMMessage
 from synthesize import SurveyAgent
-from typing import Tuple, Union, Dict, List
+from typing import Tuple, Union, Dict, List, Callable, Iterable
 from datetime import datetime
 from dataclasses import dataclass
 import re
 import json
+import asyncio
+import hashlib
 
 @dataclass
 class AgentResponsePackage:
     agent_id: str
-    agent_bio: str
+    agent_bio: str | None
     serial_number: str
     logic_flow: List[str]
     parsed_responses: List[str | int | List[int]]
@@ -20,9 +22,18 @@ class AgentResponsePackage:
     dtype_matches: List[bool]
     n_questions: int
     bad_iteration: bool
+    timed_out: bool = False
+    bio_hash: str | None = None
 
 
 
+def bio_hash(agent_bio: str) -> str:
+    """
+    Content address of an agent bio in the run's bio table
+    """
+    return hashlib.sha256(agent_bio.encode("utf-8")).hexdigest()[:16]
+
+
 def _response_from_tool_message(survey_response) -> Tuple[Union[Dict[str, str], None], Union[str, None]]:
     """
     Extracts JSON content from the message and returns it along with any extra text.
@@ -52,41 +63,192 @@ def _response_from_tool_message(survey_response) -> Tuple[Union[Dict[str, str],
         return message_content.strip() if message_content.strip() else None, None
 
 
+class _SurveyFlow:
+    """
+    Survey logic state for a single agent. Tracks the queued question variable
+    and the response logs that end up in the AgentResponsePackage.
+    """
+    def __init__(self, agent: SurveyAgent, survey_conf: Dict, survey_questions: Dict):
+        self.agent = agent
+        self.survey_logic = survey_conf["logic"]
+        self.questions = survey_questions
+        self.queued_variable = survey_conf["start"]  # queue up first question variable
+
+        # logging
+        self.logic_flow =        []
+        self.parsed_responses =  []
+        self.scraps =            []
+        self.encoded_responses = []
+        self.tool_dtypes =       []
+        self.dtype_matches =     []
+        self.n_questions =       1
+        self.bad_iteration =     False
+        self.timed_out =         False
+        self.deadline =          None  # event loop time the agent must finish by
+
+    @property
+    def done(self) -> bool:
+        return self.queued_variable is None
+
+    def queue(self, shuffle_response: bool):
+        # load up question package and corresponding survey variable
+        queued_question_package = self.questions[self.queued_variable]
+        self.agent.queue_question(self.queued_variable, queued_question_package, shuffle_response=shuffle_response)
+
+    def expire(self):
+        """
+        Ends the survey for an agent that ran past its deadline
+        """
+        self.timed_out = True
+        self.bad_iteration = True
+        self.queued_variable = None
+
+    def record(self, parsed_response, scrap, timed_out: bool = False):
+        """
+        Logs the parsed response to the queued question and steps the survey logic.
+        A timed out question is logged with the TIMEOUT tool dtype and takes the ELSE branch.
+        """
+        queued_variable = self.queued_variable
+        survey_logic = self.survey_logic
+        target_dtype = self.questions[queued_variable]["dtype"] # tool response dtype should match this
+
+        # match case to settle different tool responses
+        match parsed_response: # extensible
+            case _ if timed_out:
+                tool_dtype = "TIMEOUT"
+                encoded_response = None
+                self.bad_iteration = True
+                self.timed_out = True
+            case str():
+                # get tool response type and encoded survey response
+                tool_dtype = "TEXT"
+                encoded_response = parsed_response
+            case dict():
+                try:
+                    # get tool response type and encoded survey response
+                    tool_dtype = list(parsed_response.keys())[-1]
+                    encoded_response = parsed_response[tool_dtype]
+                except:
+                    tool_dtype = "BADRESPONSE"
+                    encoded_response = None
+                    self.bad_iteration = True
+            case None:
+                tool_dtype = "BADRESPONSE"
+                encoded_response = None
+                self.bad_iteration = True
+            case _:
+                print("something bad happened")
+                pass # this should never happen
+
+        # log responses
+        dtype_match = target_dtype == tool_dtype
+
+        self.logic_flow.append(queued_variable)
+        self.parsed_responses.append(parsed_response)
+        self.scraps.append(scrap)
+        self.encoded_responses.append(encoded_response)
+        self.tool_dtypes.append(tool_dtype)
+        self.dtype_matches.append(dtype_match)
+        self.n_questions+=1
+
+        if survey_logic[queued_variable] == None:
+            self.queued_variable = None
+            return
+        elif dtype_match:
+            flag = str(encoded_response) # 2a.
+            if flag not in survey_logic[queued_variable]:
+                flag = "ELSE"
+        # if bad match use catch
+        elif not dtype_match:
+            flag = "ELSE" # 2b.
+            self.bad_iteration = True
+
+        # survey logic
+        step = survey_logic.get(queued_variable)
+        if isinstance(step, dict):
+            self.queued_variable = step.get(flag) or (step.get("ELSE") if tool_dtype == "NUMERIC" else None)
+        elif isinstance(step, str):
+            self.queued_variable = step
+        else:
+            self.queued_variable = None
+
+    def package(self) -> AgentResponsePackage:
+        # agent id and system message
+        return AgentResponsePackage(
+            agent_id=self.agent.config.name,
+            agent_bio=self.agent.bio,
+            bio_hash=bio_hash(self.agent.bio),
+            serial_number=self.agent.serial_number,
+            logic_flow=self.logic_flow,
+            parsed_responses=self.parsed_responses,
+            responses_scraps=self.scraps,
+            encoded_responses=self.encoded_responses,
+            tool_dtypes=self.tool_dtypes,
+            dtype_matches=self.dtype_matches,
+            n_questions=self.n_questions,
+            bad_iteration=self.bad_iteration,
+            timed_out=self.timed_out)
+
+
 class SurveyEngine:
-    def __init__(self, survey_conf: Dict, survey_questions: Dict, agents: List[SurveyAgent], shuffle_response: bool, **kwargs):
+    def __init__(
+            self,
+            survey_conf: Dict,
+            survey_questions: Dict,
+            agents: Iterable[SurveyAgent],
+            shuffle_response: bool,
+            max_concurrency: int | None = None,
+            question_timeout: float | None = None,
+            agent_timeout: float | None = None,
+            schedule: str = "agent",
+            **kwargs):
+        """Survey Engine Class
+
+        Args:
+            survey_conf (Dict): survey block of config.json
+            survey_questions (Dict): question packages keyed on survey variable
+            agents (Iterable[SurveyAgent]): agents to survey, pulled one at a time as they are needed
+            shuffle_response (bool): shuffle response options on each question
+            max_concurrency (int | None, optional): Run agents concurrently on an asyncio
+                event loop with at most this many LLM requests in flight. Defaults to None (sequential).
+            question_timeout (float | None, optional): Seconds a single LLM request may take before it is
+                cancelled and logged as a TIMEOUT response. Defaults to None.
+            agent_timeout (float | None, optional): Seconds an agent may spend on the whole survey before
+                its in-flight request is cancelled and the agent is packaged as timed out. Defaults to None.
+            schedule (str, optional): "agent" finishes each agent's survey on its own, "lockstep" advances
+                all agents through the survey logic together one question at a time. Defaults to "agent".
+
+        Setting either timeout or the lockstep schedule runs the survey on the asyncio event loop, since only async requests can be cancelled.
+        """
         self.survey_conf = survey_conf
         self.questions = survey_questions
         self.agents = agents
         self.respondent_summaries = []
         self.shuffle_response = shuffle_response
+        self.max_concurrency = max_concurrency
+        self.question_timeout = question_timeout
+        self.agent_timeout = agent_timeout
+        self.schedule = schedule
+
+    def run(self, on_result: Callable[[AgentResponsePackage], None] | None = None):
+        """Surveys every agent
 
-    def run(self):
-        # survey logic and tool mapping
-        survey_logic = self.survey_conf["logic"]
+        Args:
+            on_result (Callable, optional): Called with each AgentResponsePackage as soon as that
+                agent's logic flow ends. When given, packages are not kept on the engine and
+                results() stays empty. Defaults to None.
+        """
+        if self.max_concurrency or self.question_timeout or self.agent_timeout or self.schedule == "lockstep":
+            asyncio.run(self.run_async(on_result))
+            return
 
         for agent in self.agents:
-            queued_variable = self.survey_conf["start"]               # queue up first question variable
-            queued_question_package = self.questions[queued_variable] # get corresponding question package
-            target_dtype = queued_question_package["dtype"]           # tool response dtype shoudl match this
-
-            # logging
-            logic_flow =        []
-            parsed_responses =  []
-            scraps =            []
-            encoded_responses = []
-            tool_dtypes =       []
-            dtype_matches =     []
-            n_questions =       1
-            bad_iteration =     False
+            flow = _SurveyFlow(agent, self.survey_conf, self.questions)
 
             # question queueing and execution, survey logic control
-            while queued_variable != None:
-                queued_question_package = self.questions[queued_variable] # get corresponding question package
-                target_dtype = queued_question_package["dtype"]
-
+            while not flow.done:
                 try:
-                    # load up question package and corresponding survey variable
-                    agent.queue_question(queued_variable, queued_question_package, shuffle_response=self.shuffle_response)
+                    flow.queue(self.shuffle_response)
                     agent.ask_question()
 
                     # get latest LLM response message from message history
@@ -96,80 +258,123 @@ class SurveyEngine:
                     parsed_response = None
                     scrap = None
 
-                # match case to settle different tool responses
-                match parsed_response: # extensible
-                    case str():
-                        # get tool response type and encoded survey response
-                        tool_dtype = "TEXT"
-                        encoded_response = parsed_response
-                    case dict():
-                        try:
-                            # get tool response type and encoded survey response
-                            tool_dtype = list(parsed_response.keys())[-1]
-                            encoded_response = parsed_response[tool_dtype]
-                        except:
-                            tool_dtype = "BADRESPONSE"
-                            encoded_response = None
-                            bad_iteration = True
-                    case None:
-                        tool_dtype = "BADRESPONSE"
-                        encoded_response = None
-                        bad_iteration = True
-                    case _:
-                        print("something bad happened")
-                        pass # this should never happen
-
-                # log responses
-                dtype_match = target_dtype == tool_dtype
-
-                logic_flow.append(queued_variable)
-                parsed_responses.append(parsed_response)
-                scraps.append(scrap)
-                encoded_responses.append(encoded_response)
-                tool_dtypes.append(tool_dtype)
-                dtype_matches.append(dtype_match)
-                n_questions+=1
-
-                if survey_logic[queued_variable] == None:
-                    break
-                elif dtype_match:
-                    flag = str(encoded_response) # 2a.
-                    if flag not in survey_logic[queued_variable]:
-                        flag = "ELSE"
-                # if bad match use catch
-                elif not dtype_match:
-                    flag = "ELSE" # 2b.
-                    bad_iteration = True
-
-                # survey logic
-                step = survey_logic.get(queued_variable)
-                if isinstance(step, dict):
-                    queued_variable = step.get(flag) or (step.get("ELSE") if tool_dtype == "NUMERIC" else None)
-                elif isinstance(step, str):
-                    queued_variable = step
-                else:
-                    queued_variable = None
-
-            # agent id and system message
-            agent_id = agent.config.name
-            serial_number = agent.serial_number
-            agent_bio = agent.bio
-
-            # add to package
-            response_package = AgentResponsePackage(
-                agent_id=agent_id,
-                agent_bio=agent_bio,
-                serial_number=serial_number,
-                logic_flow=logic_flow,
-                parsed_responses=parsed_responses,
-                responses_scraps=scraps,
-                encoded_responses=encoded_responses,
-                tool_dtypes=tool_dtypes,
-                dtype_matches=dtype_matches,
-                n_questions=n_questions,
-                bad_iteration=bad_iteration)
+                flow.record(parsed_response, scrap)
+
+            self._emit(flow.package(), on_result)
+
+    async def run_async(self, on_result: Callable[[AgentResponsePackage], None] | None = None):
+        """
+        Drives every agent's question loop concurrently, bounded by max_concurrency in-flight requests.
+        Packages are emitted in order of completion.
+        """
+        if self.schedule == "lockstep":
+            await self._run_lockstep_async(on_result)
+            return
+
+        # each worker pulls the next agent once its current one is emitted, so only
+        # max_concurrency agents are built and alive at a time
+        n_workers = self.max_concurrency or 1
+        semaphore = asyncio.Semaphore(n_workers)
+        agents = iter(self.agents)
+
+        async def worker():
+            for agent in agents:
+                flow = _SurveyFlow(agent, self.survey_conf, self.questions)
+                await self._run_flow_async(flow, semaphore, on_result)
+
+        await asyncio.gather(*(worker() for _ in range(n_workers)))
+
+    async def _run_flow_async(self, flow: _SurveyFlow, semaphore: asyncio.Semaphore, on_result: Callable[[AgentResponsePackage], None] | None):
+        self._set_deadline(flow)
+        while not flow.done:
+            await self._step_async(flow, semaphore)
+
+        self._emit(flow.package(), on_result)
+
+    async def _run_lockstep_async(self, on_result: Callable[[AgentResponsePackage], None] | None):
+        """
+        Question-major scheduling. Every round advances each unfinished agent by one question.
+        Agents waiting on the same question variable are submitted together as one wave, largest
+        wave first, so the server sees runs of requests for the same question. Branching agents
+        follow their own path in their own wave.
+        """
+        flows = [_SurveyFlow(agent, self.survey_conf, self.questions) for agent in self.agents]
+        semaphore = asyncio.Semaphore(self.max_concurrency or len(flows) or 1)
+        for flow in flows:
+            self._set_deadline(flow)
+
+        while flows:
+            # group agents on their queued question variable
+            waves: Dict[str, List[_SurveyFlow]] = {}
+            for flow in flows:
+                waves.setdefault(flow.queued_variable, []).append(flow)
+
+            # semaphore waiters are served in order, keeping each wave contiguous
+            ordered_waves = sorted(waves.values(), key=len, reverse=True)
+            await asyncio.gather(*(self._step_async(flow, semaphore) for wave in ordered_waves for flow in wave))
+
+            # emit and release finished agents
+            for flow in flows:
+                if flow.done:
+                    self._emit(flow.package(), on_result)
+            flows = [flow for flow in flows if not flow.done]
+
+    async def _step_async(self, flow: _SurveyFlow, semaphore: asyncio.Semaphore):
+        """
+        Asks an agent its queued question and records the response
+        """
+        agent = flow.agent
+        loop = asyncio.get_running_loop()
+        timed_out = False
+        n_history = len(agent.message_history)
+        try:
+            flow.queue(self.shuffle_response)
+            async with semaphore:
+                timeout = self._request_timeout(flow, loop.time())
+                if timeout is not None and timeout <= 0:
+                    flow.expire()
+                    return
+                # wait_for cancels the request on expiry, freeing its slot on the semaphore
+                await asyncio.wait_for(agent.ask_question_async(), timeout=timeout)
+
+            last_message = agent.message_history[-1]
+            parsed_response, scrap = _response_from_tool_message(last_message)
+        except asyncio.TimeoutError:
+            # the cancelled request already logged its user prompt, drop the unanswered turn
+            del agent.message_history[n_history:]
+            parsed_response = None
+            scrap = None
+            timed_out = True
+        except Exception:
+            parsed_response = None
+            scrap = None
+
+        flow.record(parsed_response, scrap, timed_out=timed_out)
+
+        if timed_out and flow.deadline is not None and loop.time() >= flow.deadline:
+            flow.expire()
+
+    def _set_deadline(self, flow: _SurveyFlow):
+        if self.agent_timeout:
+            flow.deadline = asyncio.get_running_loop().time() + self.agent_timeout
+
+    def _request_timeout(self, flow: _SurveyFlow, now: float) -> float | None:
+        """
+        Returns the seconds left for the next request, the lesser of the question timeout
+        and the time to the agent's deadline
+        """
+        timeouts = []
+        if self.question_timeout:
+            timeouts.append(self.question_timeout)
+        if flow.deadline is not None:
+            timeouts.append(flow.deadline - now)
+        return min(timeouts) if timeouts else None
 
+    def _emit(self, response_package: AgentResponsePackage, on_result: Callable[[AgentResponsePackage], None] | None):
+        if on_result is None:
             self.respondent_summaries.append(response_package)
+        else:
+            on_result(response_package)
 
     def results(self):
-        return self.respondent_summaries
\ No newline at end of file
+        return self.respondent_summaries
@@ -1,13 +1,24 @@
 import pandas as pd
+import numpy as np
 import geopandas as gpd
-from geopandas import GeoDataFrame
-from shapely import Point
+from pandas.api.types import union_categoricals
 import json
-from typing import List, Dict, Tuple, Optional
+import time
+import random
+import asyncio
+import multiprocessing.pool
+from itertools import islice
+from typing import List, Dict, Tuple, Optional, Set, Iterator
 from pathlib import Path
 import langroid as lr
 import langroid.language_models as lm
 from langroid.agent.chat_agent import ChatDocument
+from langroid.agent.chat_document import ChatDocMetaData
+from langroid.language_models import LLMMessage, Role
+from langroid.mytypes import Entity
+from cache import ResponseCache
+from mockllm import MockLLMServer
+from endpoints import EndpointPool
 from preprocess import *
 
 
@@ -24,6 +35,120 @@ def load_config(config_folder:str):
     return config.values()
 
 
+# rows per chunk when streaming the state PUMS person file
+PUMS_CHUNKSIZE = 200_000
+
+# bios sent to a render worker at a time, AgentFactory renders one chunk per worker ahead
+RENDER_CHUNKSIZE = 64
+
+# render seed of runs with the response cache on and no render_seed, so their prompts repeat across runs
+CACHED_RENDER_SEED = 0
+
+# declared encoding of the person tables of each source: identifiers stay strings, every other
+# attribute is a categorical of its string codes. "integer" codes are written without float
+# notation and "zero_pad" codes padded to their data dictionary width, to reconcile the POLARIS
+# PUMS export with the PUMS data dictionary.
+POPULATION_SCHEMAS = {
+    "US": {
+        "identifiers": ["SERIALNO"],
+        "integer": ["SCHL", "CITWP", "MIL", "WKHP", "WKWN", "COW"],
+        "zero_pad": {"POBP": 3, "PUMA": 5, "SCHL": 2},
+    },
+    "FR": {
+        "identifiers": ["SERIALNO"],
+        "integer": [],
+        "zero_pad": {},
+    },
+}
+
+
+def _to_categorical(df: pd.DataFrame, source: str) -> pd.DataFrame:
+    """
+    Casts the coded string attributes of a person table to categoricals per POPULATION_SCHEMAS
+    """
+    identifiers = POPULATION_SCHEMAS[source]["identifiers"]
+    return df.astype({col: "category" for col in df.columns if col not in identifiers and df[col].dtype == object})
+
+
+def _concat_categorical(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenates person tables cast by _to_categorical, unioning the categories of each
+    categorical column rather than falling back to object
+    """
+    columns = {}
+    for col in frames[0].columns:
+        parts = [frame[col] for frame in frames]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            columns[col] = pd.Series(union_categoricals(parts), name=col)
+        else:
+            columns[col] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def _normalize_codes(df: pd.DataFrame, source: str) -> pd.DataFrame:
+    """
+    Rewrites integer and zero_pad codes of POPULATION_SCHEMAS in their canonical form. Only the
+    categories of each column are normalized, then mapped back onto its rows.
+    """
+    schema = POPULATION_SCHEMAS[source]
+    for col in dict.fromkeys([*schema["integer"], *schema["zero_pad"]]):
+        if col not in df.columns:
+            continue
+        column = df[col].astype("category")
+        values = column.cat.categories.to_series().astype(str)
+        if col in schema["integer"]:
+            numbers = np.trunc(pd.to_numeric(values, errors="coerce"))
+            values = values.where(numbers.isna(), numbers.astype("Int64").astype(str))
+        if col in schema["zero_pad"]:
+            values = values.where(~values.str.isdigit(), values.str.zfill(schema["zero_pad"][col]))
+        df[col] = column.map(dict(zip(column.cat.categories, values))).astype("category")
+    return df
+
+
+def _fillna_categorical(df: pd.DataFrame, value: str) -> pd.DataFrame:
+    """
+    fillna of the columns with missing values, value is first added to the categories of
+    categorical ones. Columns without missing values are left untouched, a categorical
+    can not be filled with a value outside its categories.
+    """
+    for col in df.columns[df.isna().any().to_numpy()]:
+        column = df[col]
+        if isinstance(column.dtype, pd.CategoricalDtype) and value not in column.cat.categories:
+            column = column.cat.add_categories([value])
+        df[col] = column.fillna(value)
+    return df
+
+
+def _stratified_sample(df: pd.DataFrame, strata: str, n_per_stratum: pd.Series, random_state=0) -> pd.DataFrame:
+    """Samples rows of every stratum without replacement in one pass
+
+    Each row gets a random key, rows are sorted by stratum then key, and the first n_k rows
+    ranked within stratum k are kept. Strata missing from n_per_stratum are dropped, strata
+    smaller than n_k are taken whole, and the sample follows the order of n_per_stratum.
+
+    Args:
+        df (pd.DataFrame): population to sample from
+        strata (str): column holding the stratum of each row
+        n_per_stratum (pd.Series): sample size n_k indexed by stratum
+        random_state (optional): seed of the random keys. Defaults to 0.
+    """
+    rng = np.random.default_rng(random_state)
+    position = df[strata].map(pd.Series(np.arange(len(n_per_stratum)), index=n_per_stratum.index))
+    keep = position.notna().to_numpy()
+    position = position.to_numpy()[keep].astype(np.int64)
+    rows = np.flatnonzero(keep)
+
+    # sort by stratum position, random key within stratum
+    order = np.lexsort((rng.random(len(rows)), position))
+    rows, position = rows[order], position[order]
+
+    # rank within stratum: offset from the first row of its run
+    starts = np.flatnonzero(np.r_[True, position[1:] != position[:-1]])
+    rank = np.arange(len(position)) - np.repeat(starts, np.diff(np.r_[starts, len(position)]))
+    take = rank < n_per_stratum.to_numpy()[position]
+    return df.iloc[rows[take]].reset_index(drop=True)
+
+
 def synthesize_population(config_folder:str, n_sample:int, source:str="US", min_age: int|None = None, max_age: int|None = None, read_from_dataset: bool|None = True, random_state=0) -> pd.DataFrame | None:
     """
     Returns a spatially proportional sample of the PUMS dataset based on CMAP My Daily Travel Survey respondent sample.
@@ -41,54 +166,48 @@ def synthesize_population(config_folder:str, n_sample:int, source:str="US", min_
 
             crs:str = "EPSG:4326"
 
-            # load PUMS and PUMA data
-            person_df = pd.read_csv(data_folder/"person.csv", low_memory=False)
-            location_df = pd.read_csv(data_folder/"location.csv")
-
-            pums_person_df = pd.read_csv(data_folder/"psam_p17.csv", dtype=str)
-            if min_age is not None:
-                pums_person_df = pums_person_df[pums_person_df.AGEP.astype(int) >= min_age]
-            if max_age is not None:
-                pums_person_df = pums_person_df[pums_person_df.AGEP.astype(int) <= max_age]
-
-            puma_gdf = gpd.read_file(data_folder/"tl_2019_17_puma10.shp")
-            puma_gdf = puma_gdf.to_crs(crs=crs)
-            puma_gdf["PUMA"] = puma_gdf["PUMACE10"].astype(int)
+            # load travel survey households, only the columns used
+            person_df = pd.read_csv(data_folder/"person.csv", usecols=["sampno", "perno"])
+            location_df = pd.read_csv(data_folder/"location.csv", usecols=["sampno", "loctype", "longitude", "latitude"])
+
+            # load PUMS persons in chunks, keeping the decoded attributes and filtering age on read,
+            # each chunk is cast to categoricals so the object columns are never held whole
+            pums_cols = {"SERIALNO", "PUMA", "AGEP", *load_pums_data(config_folder).keys()}
+            pums_chunks = []
+            for chunk in pd.read_csv(data_folder/"psam_p17.csv", dtype=str, usecols=lambda col: col in pums_cols, chunksize=PUMS_CHUNKSIZE):
+                age = chunk.AGEP.astype(int)
+                if min_age is not None:
+                    chunk = chunk[age >= min_age]
+                    age = age[age >= min_age]
+                if max_age is not None:
+                    chunk = chunk[age <= max_age]
+                pums_chunks.append(_to_categorical(chunk, source))
+            pums_person_df = _concat_categorical(pums_chunks)
+
+            puma_gdf = puma_geometries(config_folder, crs=crs)
 
             # get the size of each household
-            household_sizes = person_df[["sampno", "perno"]].groupby(by="sampno")["perno"].max()
+            household_sizes = person_df.groupby(by="sampno")["perno"].max()
             household_locations = location_df[location_df.loctype==1] \
                 .drop_duplicates(subset="sampno") \
                 .set_index("sampno")[["longitude", "latitude"]] # always x, y for spatial operations apparently
             household_locations = household_locations.join(household_sizes)
 
-            # get household locations as gdf
-            geometry = household_locations.apply(
-                lambda row: Point(row.longitude, row.latitude), axis=1
-            )
-            household_gdf = GeoDataFrame(household_locations, geometry=geometry, crs=crs)
-
-            # get count of households in each PUMA zone
-            household_join = household_gdf.sjoin(puma_gdf, predicate="within")
-            household_counts = household_join.groupby(by=["PUMA"])["perno"].sum()
-            puma_household_counts = puma_gdf \
-                .set_index("PUMA") \
-                .join(household_counts, how="inner")[["GEOID10", "PUMACE10", "NAMELSAD10", "perno", "geometry"]]
-            puma_household_counts.reset_index(inplace=True)
+            # count persons of households within each PUMA zone through the PUMA spatial index
+            household_points = gpd.points_from_xy(household_locations.longitude, household_locations.latitude, crs=crs)
+            household_index, puma_index = puma_gdf.sindex.query(household_points, predicate="within")
+            household_counts = np.bincount(
+                puma_index,
+                weights=household_locations.perno.fillna(0).to_numpy()[household_index],
+                minlength=len(puma_gdf))
+            puma_household_counts = pd.Series(household_counts, index=puma_gdf.PUMACE10.to_numpy())
+            puma_household_counts = puma_household_counts[np.isin(np.arange(len(puma_gdf)), puma_index)]
 
             # sample by PUMA area
-            samples = []
-            puma_household_counts["weight"] = puma_household_counts.perno / puma_household_counts.perno.sum()
-            for _, row in puma_household_counts.iterrows():
-                puma = row.PUMACE10
-                weight = row.weight
-                n = max(int(weight*n_sample), 1)
-
-                sample = pums_person_df[pums_person_df.PUMA==puma].sample(n, random_state=random_state)
-                samples.append(sample)
-
-            population_sample = pd.concat(samples)
-            population_sample.fillna(na_str, inplace=True)
+            weight = puma_household_counts / puma_household_counts.sum()
+            n_per_puma = (weight * n_sample).astype(int).clip(lower=1)
+            population_sample = _stratified_sample(pums_person_df, "PUMA", n_per_puma, random_state=random_state)
+            population_sample = _fillna_categorical(population_sample, na_str)
 
             return population_sample
 
@@ -98,109 +217,37 @@ def synthesize_population(config_folder:str, n_sample:int, source:str="US", min_
             using inputs from https://polaris.taps.anl.gov/polaris-studio/prepare/population_synthesis.html
             """
 
-            config_folder = Path(config_folder)
-
-            # get populationsim synthetic population
-            popsim_df = pd.read_csv(config_folder / "data/populationsim/output/synthetic_persons.csv")
-
-            # get PUMS dataset from POLARIS
-            pums_df = pd.read_csv(config_folder / "data/populationsim/data/pums_person_chicago.csv", dtype=str)
-
-            # get PUMS PUMA geography
+            # get puma areas within cmap planning boundary, cached from the PUMA and CMAP shapefiles
             # https://catalog.data.gov/dataset/tiger-line-shapefile-2019-2010-state-illinois-2010-census-public-use-microdata-area-puma-state-
-            puma_gdf = gpd.read_file(config_folder / "data/tl_2019_17_puma10.shp")
-
-            # get CMAP planning area
             # https://datahub.cmap.illinois.gov/datasets/4834d52310d24e56a0300898a0cb23bc_0/explore
-            cmap_gdf = gpd.read_file(config_folder / "data/Facility_Planning_Areas_2016.shp")
-
-            # get puma areas within cmap planning boundary
-            cmap_gdf.to_crs(puma_gdf.crs, inplace=True)
-            cmap_boundary = cmap_gdf.geometry.union_all()
-            puma_in_cmap_gdf = puma_gdf[puma_gdf.geometry.intersects(cmap_boundary)].reset_index(drop=True)
+            stpumas = [int("17" + str(x)) for x in cmap_pumas(config_folder)]
 
-            # add STPUMA to puma_in_cmap gdf
-            puma_in_cmap_gdf["STPUMA"] = puma_in_cmap_gdf["PUMACE10"].apply(
-                lambda x: int("17" + str(x))
-            )
-
-            # get population totals by STPUMA from popsim df
-            pop_totals = popsim_df.groupby("STPUMA").size().reset_index(name="count")
-            pop_totals.columns = ["STPUMA", "POP_COUNT"]
-            puma_with_pop_gdf = puma_in_cmap_gdf.merge(pop_totals, how="left", left_on="STPUMA", right_on="STPUMA")
-
-            # get share of population in PUMA areas
-            puma_with_pop_gdf["SHARE"] = puma_with_pop_gdf.POP_COUNT / puma_with_pop_gdf.POP_COUNT.sum()
-
-            # add STPUMA to puma_in_cmap gdf
-            puma_in_cmap_gdf["STPUMA"] = puma_in_cmap_gdf["PUMACE10"].apply(
-                lambda x: int("17" + str(x))
-            )
-
-            # get population totals by STPUMA from popsim df
-            pop_totals = popsim_df.groupby("STPUMA").size().reset_index(name="count")
-            pop_totals.columns = ["STPUMA", "POP_COUNT"]
-            puma_with_pop_gdf = puma_in_cmap_gdf.merge(pop_totals, how="left", left_on="STPUMA", right_on="STPUMA")
-
-            # get share of population in PUMA areas
-            puma_with_pop_gdf["SHARE"] = puma_with_pop_gdf.POP_COUNT / puma_with_pop_gdf.POP_COUNT.sum()
-
-            # okay now filter PUMS dataset by SERIALNO in popsim
-            pums_in_popsim_df = pums_df[pums_df.SERIALNO.isin(popsim_df.SERIALNO.astype(str).unique())]
+            # get share of population in PUMA areas from populationsim totals by STPUMA
+            pop_totals = popsim_counts(config_folder)
+            pop_counts = pd.Series([pop_totals.get(str(stpuma)) for stpuma in stpumas], index=stpumas, dtype=float).fillna(0)
+            shares = pop_counts / pop_counts.sum()
+            n_per_stpuma = (shares * n_sample).astype(int).clip(lower=1)
 
+            # read PUMS persons of the synthetic population in the cmap PUMAs and age range from the population store
+            filters = [("STPUMA", "in", stpumas)]
             if min_age is not None:
-                pums_in_popsim_df = pums_in_popsim_df[pums_in_popsim_df.AGEP.astype(int) >= min_age]
+                filters.append(("AGEP", ">=", min_age))
             if max_age is not None:
-                pums_in_popsim_df = pums_in_popsim_df[pums_in_popsim_df.AGEP.astype(int) <= max_age]
+                filters.append(("AGEP", "<=", max_age))
+            pums_in_popsim_df = pd.read_parquet(population_store(config_folder), filters=filters)
 
-            samples = []
-            for _, row in puma_with_pop_gdf.iterrows():
-                STPUMA = str(row.STPUMA)
-                share = row.SHARE
+            # draw every PUMA at once
+            pums_sample = _stratified_sample(pums_in_popsim_df, "STPUMA", n_per_stpuma, random_state=0)
 
-                n = max(int(share*n_sample), 1)
-                sample = pums_in_popsim_df[pums_in_popsim_df.STPUMA==STPUMA].sample(
-                    n=n,
-                    replace=False,
-                    random_state=0)
-                samples.append(sample)
-
-            pums_sample = pd.concat(samples).reset_index(drop=True)
+            # back to the string encoding of the PUMS csv
+            pums_sample = pums_sample.astype({"STPUMA": str, "AGEP": str})
+            pums_sample = pums_sample.where(pums_sample.notna(), np.nan)
 
             # post processing
             # there are some encoding discrepancies bt the original PUMS dataset
             # used and thePOLARIS pums dataset generated by the api.
-
-            # Function to pad strings that are numeric
-            def pad_numeric_str(val, total_chars):
-                return val.zfill(total_chars) if val.isdigit() else val
-
-            # try on POBP
-            pums_sample["POBP"] = pums_sample["POBP"].apply(lambda x: pad_numeric_str(x, 3))
-            pums_sample["PUMA"] = pums_sample["PUMA"].apply(lambda x: pad_numeric_str(x, 5))
-
-            # this is garbage
-            pums_sample["SCHL"] = pums_sample["SCHL"].apply(lambda x: pad_numeric_str(str(int(float(x))), 2))
-            pums_sample["CITWP"] = pums_sample["CITWP"].astype(float).astype(int).astype(str)
-            pums_sample["MIL"] = pums_sample["MIL"].astype(float).astype(int).astype(str)
-            pums_sample["WKHP"] = pums_sample["WKHP"].astype(float).astype(int).astype(str)
-            pums_sample["WKWN"] = pums_sample["WKWN"].astype(float).astype(int).astype(str)
-            pums_sample["COW"] = pums_sample["COW"].astype(float).astype(int).astype(str)
-
-
-            # def try_int(val):
-            #     try:
-            #         # Try converting to int only if string/int-like
-            #         if isinstance(val, str) and val.strip().isdigit():
-            #             return int(val)
-            #         elif isinstance(val, (int, float)) and val == int(val):
-            #             return int(val)
-            #     except:
-            #         pass
-            #     return val  # Leave unchanged if conversion fails
-
-            # pums_sample = pums_sample.map(try_int)
-            # pums_sample = pums_sample.astype(str)
+            pums_sample = _to_categorical(pums_sample, source)
+            pums_sample = _normalize_codes(pums_sample, source)
 
             return pums_sample
 
@@ -220,7 +267,7 @@ def synthesize_population(config_folder:str, n_sample:int, source:str="US", min_
             df = df[(df["AGE_INT"] > min_age) & (df["AGE_INT"] < max_age)]
             df.drop(labels="AGE_INT", axis=1, inplace=True)
 
-            return df
+            return _to_categorical(df, source)
 
 
 class _singleAnswerTool(lr.agent.ToolMessage):
@@ -290,7 +337,15 @@ class SurveyAgent(lr.ChatAgent):
     Subclasses Langroid's Chat Agent Class for LLM interfacing and
     logic
     """
-    def __init__(self, config: lr.ChatAgentConfig, agent_id: str, bio:str, serial_number: str):
+    def __init__(
+            self,
+            config: lr.ChatAgentConfig,
+            agent_id: str,
+            bio:str,
+            serial_number: str,
+            response_cache: ResponseCache | None = None,
+            endpoint_pool: EndpointPool | None = None,
+            shuffle_seed: int | None = None):
         super().__init__(config)
         """Survey Agent Class
 
@@ -299,6 +354,10 @@ class SurveyAgent(lr.ChatAgent):
             agent_id (str): Agent ID linked to synthesis
             bio (str): Unique contents of system message based on heterogeneous socio-demographic data
             serial_number (str): ID linked to original population synthesis dataset
+            response_cache (ResponseCache | None, optional): On-disk LLM response cache. Defaults to None.
+            endpoint_pool (EndpointPool | None, optional): Routes each request to one of several LLM servers. Defaults to None.
+            shuffle_seed (int | None, optional): Seeds the response option shuffle of every question, so a replayed
+                survey sends the same prompts and hits the response cache. Defaults to None (global random state).
         """
 
         # a lot of this logging stuff has been moved to survey logic, remove this eventually
@@ -306,6 +365,9 @@ class SurveyAgent(lr.ChatAgent):
         self.agent_id = agent_id
         self.bio = bio
         self.serial_number = serial_number # on PUMS dataset, need to configure for other datasets eventually
+        self.response_cache = response_cache
+        self.endpoint_pool = endpoint_pool
+        self.shuffle_seed = shuffle_seed
         self.responses = []
         self.question_variables = []
         self.question_dtypes = []
@@ -336,7 +398,10 @@ class SurveyAgent(lr.ChatAgent):
         if shuffle_response:
             # shuffle key-value pairs and rebuild the dict
             items = list(self.possible_responses.items())
-            random.shuffle(items)
+            if self.shuffle_seed is None:
+                random.shuffle(items)
+            else:
+                random.Random(f"{self.shuffle_seed}|{variable}").shuffle(items)
             self.possible_responses = dict(items)
 
         self.queued_keys = list(self.possible_responses.keys())
@@ -355,11 +420,107 @@ class SurveyAgent(lr.ChatAgent):
                 )
 
     def llm_response(self, message: Optional[str | ChatDocument] = None) -> Optional[ChatDocument]:
-        return super().llm_response(message)
+        if self.response_cache is None or not isinstance(message, str):
+            return self._routed_llm_response(message)
+
+        key = self._cache_key(message)
+        content = self.response_cache.get(key)
+        if content is not None:
+            return self._cached_llm_response(message, content)
+
+        response = self._routed_llm_response(message)
+        if response is not None:
+            self.response_cache.put(key, response.content)
+        return response
+
+    async def llm_response_async(self, message: Optional[str | ChatDocument] = None) -> Optional[ChatDocument]:
+        if self.response_cache is None or not isinstance(message, str):
+            return await self._routed_llm_response_async(message)
+
+        key = self._cache_key(message)
+        content = self.response_cache.get(key)
+        if content is not None:
+            return self._cached_llm_response(message, content)
+
+        response = await self._routed_llm_response_async(message)
+        if response is not None:
+            self.response_cache.put(key, response.content)
+        return response
+
+    def _routed_llm_response(self, message: Optional[str | ChatDocument] = None) -> Optional[ChatDocument]:
+        """
+        Sends the request to the least loaded endpoint of the pool, failing over to the
+        next endpoint when a request errors
+        """
+        if self.endpoint_pool is None:
+            return super().llm_response(message)
+
+        n_history = len(self.message_history)
+        for attempt in range(len(self.endpoint_pool)):
+            endpoint = self.endpoint_pool.acquire()
+            self.llm = endpoint.llm
+            start = time.perf_counter()
+            try:
+                response = super().llm_response(message)
+            except Exception:
+                self.endpoint_pool.release(endpoint, None, ok=False)
+                del self.message_history[n_history:] # drop the half-finished exchange before failover
+                if attempt == len(self.endpoint_pool) - 1:
+                    raise
+                continue
+            self.endpoint_pool.release(endpoint, time.perf_counter() - start)
+            return response
+
+    async def _routed_llm_response_async(self, message: Optional[str | ChatDocument] = None) -> Optional[ChatDocument]:
+        if self.endpoint_pool is None:
+            return await super().llm_response_async(message)
+
+        n_history = len(self.message_history)
+        for attempt in range(len(self.endpoint_pool)):
+            endpoint = await self.endpoint_pool.acquire_async()
+            self.llm = endpoint.llm
+            start = time.perf_counter()
+            try:
+                response = await super().llm_response_async(message)
+            except asyncio.CancelledError:
+                self.endpoint_pool.release(endpoint, None)
+                del self.message_history[n_history:] # drop the unanswered user prompt of the cancelled request
+                raise
+            except Exception:
+                self.endpoint_pool.release(endpoint, None, ok=False)
+                del self.message_history[n_history:] # drop the half-finished exchange before failover
+                if attempt == len(self.endpoint_pool) - 1:
+                    raise
+                continue
+            self.endpoint_pool.release(endpoint, time.perf_counter() - start)
+            return response
+
+    def _cache_key(self, message: str) -> str:
+        """
+        Cache key on the model, sampling parameters and the full message history plus the new message
+        """
+        llm_config = self.config.llm
+        messages = [("system", self.config.system_message)]
+        messages.extend((str(m.role), m.content) for m in self.message_history)
+        messages.append(("user", message))
+        return ResponseCache.key(llm_config.chat_model, llm_config.temperature, getattr(llm_config, "seed", None), messages)
+
+    def _cached_llm_response(self, message: str, content: str) -> ChatDocument:
+        """
+        Replays a cached LLM response into the message history as if the model had answered
+        """
+        if not self.message_history:
+            self.message_history = [self._create_system_and_tools_message()]
+        self.message_history.append(LLMMessage(role=Role.USER, content=message))
+        self.message_history.append(LLMMessage(role=Role.ASSISTANT, content=content))
+        return ChatDocument(content=content, metadata=ChatDocMetaData(sender=Entity.LLM))
 
     def ask_question(self):
         self.llm_response(self.queued_question)
 
+    async def ask_question_async(self):
+        await self.llm_response_async(self.queued_question)
+
     def singleAnswerResponse(self, msg: _singleAnswerTool) -> str:
         # return answer if exists in queued keys
         self.dtype_matches.append("TEXT" == self.question_dtypes[-1])
@@ -376,72 +537,223 @@ class SurveyAgent(lr.ChatAgent):
         return str(msg.NUMERIC if msg.NUMERIC not in self.queued_keys else None)
 
 
-def build_agents(config_folder:str, n: int, source: str, subsample: int | None = None, **kwargs):
-    model_config, synth_conf, _, _ = load_config(config_folder)
-    population_sample = synthesize_population(config_folder=config_folder, n_sample=subsample, source=source, min_age=18, max_age=65)
+def build_llm(model_config: Dict) -> Tuple[lm.OpenAIGPTConfig, EndpointPool | None]:
+    """
+    Builds the LLM config from the model block of config.json.
 
-    assert isinstance(population_sample, pd.DataFrame)
+    An "endpoints" list spreads requests over several servers through an EndpointPool.
+    Entries are either an api_base url or a dict of overrides of the model block.
+    A "mock" entry starts local MockLLMServers with those settings instead,
+    "n_endpoints" of them (default 1).
 
-    if source == "US":
-        person = process_pums_data(config_folder=config_folder)
-        ploc = puma_locations(config_folder)
-    if source == "FR":
-        person = process_insee_census(config_folder=config_folder)
-        ploc = None
+    Returns:
+        Tuple[lm.OpenAIGPTConfig, EndpointPool | None]: config of the first endpoint and
+        the endpoint pool when there is more than one endpoint
+    """
+    model_config = dict(model_config)
+    mock_conf = model_config.pop("mock", None)
+    endpoints = model_config.pop("endpoints", None) or [{}]
+    retry_after = model_config.pop("endpoint_retry_after", 30.0)
+
+    if mock_conf is not None:
+        mock_conf = dict(mock_conf)
+        n_endpoints = mock_conf.pop("n_endpoints", 1)
+        servers = [MockLLMServer(**mock_conf).start() for _ in range(n_endpoints)]
+        endpoints = [{"chat_model": server.chat_model} for server in servers]
+        model_config.setdefault("stream", False)
+
+    llm_configs = []
+    for endpoint in endpoints:
+        overrides = {"api_base": endpoint} if isinstance(endpoint, str) else endpoint
+        llm_configs.append(lm.OpenAIGPTConfig(**{**model_config, **overrides}))
+
+    endpoint_pool = EndpointPool(llm_configs, retry_after=retry_after) if len(llm_configs) > 1 else None
+    return llm_configs[0], endpoint_pool
+
+
+"""
+Must manually change tool use formatting instructions to FRENCH
+https://github.com/langroid/langroid/blob/main/langroid/agent/chat_agent.py
+lines 178 and 180.
+"""
+
+# these must be changed to reflect new agent tools
+_FR_SYSTEM_TOOL_INSTRUCTIONS = '=== DIRECTIVES SUR L\'UTILISATION DE CERTAINS OUTILS/FONCTIONS ===\n            TOOL: singleAnswerResponse:\n                        DIRECTIVES: \n        IMPORTANT: Lors de l\'utilisation de cet outil ou de tout autre outil/fonction, vous DEVEZ inclure un \n        `request` champ et le définir égal au NOM DE L\'OUTIL/FONCTION que vous avez l\'intention d\'utiliser.\n\n\n\n\nTOOL: multipleAnswerResponse:\n                        DIRECTIVES: \n        IMPORTANT: Lors de l\'utilisation de cet outil ou de tout autre outil/fonction, vous DEVEZ inclure un \n        `request` champ et le définir égal au NOM DE L\'OUTIL/FONCTION que vous avez l\'intention d\'utiliser.\n\n\n\n\nTOOL: discreteNumericResponse:\n                        DIRECTIVES: \n        IMPORTANT: Lors de l\'utilisation de cet outil ou de tout autre outil/fonction, vous DEVEZ inclure un \n        `request` champ et le définir égal au NOM DE L\'OUTIL/FONCTION que vous avez l\'intention d\'utiliser.\n\n\n\n'
+
+_FR_SYSTEM_TOOL_FORMAT_INSTRUCTIONS = '\n=== TOUS LES OUTILS DISPONIBLES et LEURS INSTRUCTIONS DE FORMAT ===\nVous avez accès aux OUTILS suivants pour accomplir votre tâche :\n\nTOOL: singleAnswerResponse\n            OBJECTIF: \n        Répondre avec le <TEXT> de la réponse que vous spécifiez.\n\n            FORMAT JSON: {\n    "type": "object",\n    "properties": {\n        "request": {\n            "default": "singleAnswerResponse",\n            "type": "string"\n        },\n        "TEXT": {\n            "type": "integer"\n        }\n    },\n    "required": [\n        "TEXT",\n        "request"\n    ],\n    "request": {\n        "enum": [\n            "singleAnswerResponse"\n        ],\n        "type": "string"\n    }\n}\n\n\n\nTOOL: multipleAnswerResponse\n            OBJECTIF: \n    Répondre avec une liste de <TEXT> des réponses qui s\'appliquent à votre réponse.\n\n            FORMAT JSON: {\n    "type": "object",\n    "properties": {\n        "request": {\n            "default": "multipleAnswerResponse",\n            "type": "string"\n        },\n        "TEXT": {\n            "type": "array",\n            "minItems": 1,\n            "maxItems": 1,\n            "items": [\n                {\n                    "type": "integer"\n                }\n            ]\n        }\n    },\n    "required": [\n        "TEXT",\n        "request"\n    ],\n    "request": {\n        "enum": [\n            "multipleAnswerResponse"\n        ],\n        "type": "string"\n    }\n}\n\n\n\nTOOL: discreteNumericResponse\n            OBJECTIF: \n        Répondre avec une valeur <NUMERIC> appropriée lorsque aucune des réponses possibles n’a de sens à appliquer.\n\n            FORMAT JSON: {\n    "type": "object",\n    "properties": {\n        "request": {\n            "default": "discreteNumericResponse",\n            "type": "string"\n        },\n        "NUMERIC": {\n            "type": "integer"\n        }\n    },\n    "required": [\n        "NUMERIC",\n        "request"\n    ],\n    "request": {\n        "enum": [\n            "discreteNumericResponse"\n        ],\n        "type": "string"\n    }\n}\n\n\n\nLorsqu’un des OUTILS ci-dessus est applicable, vous devez exprimer votre \ndemande par "TOOL :" suivi de la requête dans le format ci-dessus.\n'
+
+
+class AgentFactory:
+    def __init__(
+            self,
+            population_sample: pd.DataFrame,
+            MsgGen: SystemMessageGenerator,
+            person: Dict,
+            ploc: Dict | None,
+            source: str,
+            synth_conf: Dict,
+            llm_config: lm.OpenAIGPTConfig,
+            subsample: int | None = None,
+            response_cache: ResponseCache | None = None,
+            endpoint_pool: EndpointPool | None = None):
+        """
+        Lazily builds SurveyAgents from the population sample. System messages are
+        rendered and langroid agents created only as the survey engine pulls them,
+        so no more agents are alive than the scheduler is working on. With
+        render_processes set in synth_conf, pending bios are rendered in batches of
+        RENDER_CHUNKSIZE per process across a process pool instead; render_seed makes
+        bios reproducible and seeds each agent's response option shuffle. A null
+        render_seed draws a new seed every run, unless the response cache is on: it is
+        then fixed to CACHED_RENDER_SEED so replayed runs send the same prompts.
 
-    MsgGen = SystemMessageGenerator(config_folder, "SystemMessage.j2", **kwargs)
+        Args:
+            population_sample (pd.DataFrame): encoded population sample
+            MsgGen (SystemMessageGenerator): system message renderer
+            person (Dict): attribute decoder from process_pums_data/process_insee_census
+            ploc (Dict | None): PUMA locations for templating
+            source (str): "US" or "FR"
+            synth_conf (Dict): synthesis block of config.json
+            llm_config (lm.OpenAIGPTConfig): LLM configuration of every agent
+            subsample (int | None, optional): only build agents for the first subsample persons. Defaults to None.
+            response_cache (ResponseCache | None, optional): On-disk LLM response cache. Defaults to None.
+            endpoint_pool (EndpointPool | None, optional): LLM endpoint pool. Defaults to None.
+        """
+        self.population_sample = population_sample.iloc[0:subsample]
+        self.MsgGen = MsgGen
+        self.person = person
+        self.ploc = ploc
+        self.source = source
+        self.llm_config = llm_config
+        self.response_cache = response_cache
+        self.endpoint_pool = endpoint_pool
+        self.completed = set()
+
+        # synthesis configuration vars
+        self.sim_year = synth_conf.get("sim_year")
+        self.header = synth_conf.get("system_message_header")
+        self.footer = synth_conf.get("system_message_footer")
+        self.attribute_descriptions = get_attribute_descriptions(person)
+        self.render_processes = synth_conf.get("render_processes")
+
+        # agent i is rendered and shuffles its response options with seed render_seed + i, so bios
+        # match however they are rendered and replayed surveys send the same prompts
+        self.render_seed = synth_conf.get("render_seed")
+        if self.render_seed is None:
+            self.render_seed = CACHED_RENDER_SEED if response_cache is not None else random.getrandbits(32)
+
+        # decode the whole sample at once, agents are templated from the per-person records
+        self.individual_attributes = attribute_decoder_frame(self.population_sample, person).to_dict("records")
+        self.serial_numbers = self.population_sample["SERIALNO"].astype(object).to_list()
+
+    def skip(self, completed: Set[Tuple[str, str]]) -> None:
+        """
+        Skips agents whose (agent_id, serial_number) key is in completed
+        """
+        self.completed = {(str(agent_id), str(serial_number)) for agent_id, serial_number in completed}
+
+    def _pending(self) -> Iterator[Tuple[int, Dict, str]]:
+        for i, (individual_attributes, serial_number) in enumerate(zip(self.individual_attributes, self.serial_numbers)):
+            if (f"Agent_{i}", str(serial_number)) not in self.completed:
+                yield i, individual_attributes, serial_number
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self._pending())
+
+    def __iter__(self) -> Iterator[SurveyAgent]:
+        pending = self._pending()
+        if self.render_processes is None or self.render_processes <= 1:
+            for i, individual_attributes, serial_number in pending:
+                yield self._build(i, individual_attributes, serial_number)
+            return
+
+        # render pending bios a batch ahead of the scheduler, one chunk per worker process. The
+        # next batch renders in the workers while agents of the current one are handed out, so
+        # the caller, an event loop in async mode, only waits on bios that are not ready yet
+        batch_size = self.render_processes * RENDER_CHUNKSIZE
+        with self.MsgGen.render_pool(self.render_processes, **self._template_kwargs()) as pool:
+            batch = list(islice(pending, batch_size))
+            system_messages = self._submit(pool, batch)
+            while batch:
+                next_batch = list(islice(pending, batch_size))
+                next_system_messages = self._submit(pool, next_batch)
+                for (i, individual_attributes, serial_number), system_message in zip(batch, system_messages):
+                    yield self._build(i, individual_attributes, serial_number, system_message)
+                batch, system_messages = next_batch, next_system_messages
+
+    def _submit(self, pool: multiprocessing.pool.Pool, batch: List[Tuple[int, Dict, str]]) -> Iterator[str]:
+        return self.MsgGen.submit_system_messages(
+            pool,
+            [individual_attributes for _, individual_attributes, _ in batch],
+            [self.render_seed + i for i, _, _ in batch],
+            chunksize=RENDER_CHUNKSIZE)
+
+    def _template_kwargs(self) -> Dict:
+        return {**self.attribute_descriptions, "ploc": self.ploc, "YEAR": self.sim_year}
+
+    def _build(self, i: int, individual_attributes: Dict, serial_number: str, system_message: str | None = None) -> SurveyAgent:
+        if system_message is None:
+            system_message = self.MsgGen.write_seeded_system_message(
+                self.render_seed + i,
+                **individual_attributes,
+                **self._template_kwargs())
 
-    # synthesis configuration vars
-    sim_year = synth_conf.get("sim_year")
-    header = synth_conf.get("system_message_header")
-    footer = synth_conf.get("system_message_footer")
-
-    system_messages = []
-    serial_numbers = [] # link to person dataset
-
-    attribute_descriptions = get_attribute_descriptions(person)
-    for i, individual in population_sample.iterrows():
-        individual_attributes = attribute_decoder_dict(individual.to_dict(), person)
-        system_message = MsgGen.write_system_message(
-            **individual_attributes,
-            **attribute_descriptions,
-            ploc=ploc,
-            YEAR=sim_year)
-
-        system_messages.append(system_message)
-        serial_numbers.append(individual["SERIALNO"])
-
-    llm_config = lm.OpenAIGPTConfig(**model_config)
-    agents = []
-    for i, zipped_content in enumerate(zip(system_messages[0:subsample], serial_numbers[0:subsample])):
-        system_message, serial_number = zipped_content
         agent_config = lr.ChatAgentConfig(
             name=f"Agent_{i}",
-            llm=llm_config,
-            system_message= header + system_message + footer,   # system message configuration
-            use_tools=True,                                     # - could have more in the future
+            llm=self.llm_config,
+            system_message= self.header + system_message + self.footer,   # system message configuration
+            use_tools=True,                                               # - could have more in the future
             use_functions_api=False)
-        agent = SurveyAgent(config=agent_config, agent_id = i, bio = system_message, serial_number = serial_number)
+        agent = SurveyAgent(config=agent_config, agent_id = i, bio = system_message, serial_number = serial_number, response_cache = self.response_cache, endpoint_pool = self.endpoint_pool, shuffle_seed = self.render_seed + i)
         agent.enable_message(_singleAnswerTool)
         agent.enable_message(_multipleAnswerTool)
         agent.enable_message(_discreteNumericTool)
-        agents.append(agent)
 
-    """
-    Must manually change tool use formatting instructions to FRENCH
-    https://github.com/langroid/langroid/blob/main/langroid/agent/chat_agent.py
-    lines 178 and 180.
-    """
+        if self.source == "FR":
+            agent.system_tool_instructions = _FR_SYSTEM_TOOL_INSTRUCTIONS
+            agent.system_tool_format_instructions = _FR_SYSTEM_TOOL_FORMAT_INSTRUCTIONS
 
-    # these must be changed to reflect new agent tools
-    fr_system_tool_instructions = '=== DIRECTIVES SUR L\'UTILISATION DE CERTAINS OUTILS/FONCTIONS ===\n            TOOL: singleAnswerResponse:\n                        DIRECTIVES: \n        IMPORTANT: Lors de l\'utilisation de cet outil ou de tout autre outil/fonction, vous DEVEZ inclure un \n        `request` champ et le définir égal au NOM DE L\'OUTIL/FONCTION que vous avez l\'intention d\'utiliser.\n\n\n\n\nTOOL: multipleAnswerResponse:\n                        DIRECTIVES: \n        IMPORTANT: Lors de l\'utilisation de cet outil ou de tout autre outil/fonction, vous DEVEZ inclure un \n        `request` champ et le définir égal au NOM DE L\'OUTIL/FONCTION que vous avez l\'intention d\'utiliser.\n\n\n\n\nTOOL: discreteNumericResponse:\n                        DIRECTIVES: \n        IMPORTANT: Lors de l\'utilisation de cet outil ou de tout autre outil/fonction, vous DEVEZ inclure un \n        `request` champ et le définir égal au NOM DE L\'OUTIL/FONCTION que vous avez l\'intention d\'utiliser.\n\n\n\n'
+        return agent
 
-    fr_system_tool_format_instructions = '\n=== TOUS LES OUTILS DISPONIBLES et LEURS INSTRUCTIONS DE FORMAT ===\nVous avez accès aux OUTILS suivants pour accomplir votre tâche :\n\nTOOL: singleAnswerResponse\n            OBJECTIF: \n        Répondre avec le <TEXT> de la réponse que vous spécifiez.\n\n            FORMAT JSON: {\n    "type": "object",\n    "properties": {\n        "request": {\n            "default": "singleAnswerResponse",\n            "type": "string"\n        },\n        "TEXT": {\n            "type": "integer"\n        }\n    },\n    "required": [\n        "TEXT",\n        "request"\n    ],\n    "request": {\n        "enum": [\n            "singleAnswerResponse"\n        ],\n        "type": "string"\n    }\n}\n\n\n\nTOOL: multipleAnswerResponse\n            OBJECTIF: \n    Répondre avec une liste de <TEXT> des réponses qui s\'appliquent à votre réponse.\n\n            FORMAT JSON: {\n    "type": "object",\n    "properties": {\n        "request": {\n            "default": "multipleAnswerResponse",\n            "type": "string"\n        },\n        "TEXT": {\n            "type": "array",\n            "minItems": 1,\n            "maxItems": 1,\n            "items": [\n                {\n                    "type": "integer"\n                }\n            ]\n        }\n    },\n    "required": [\n        "TEXT",\n        "request"\n    ],\n    "request": {\n        "enum": [\n            "multipleAnswerResponse"\n        ],\n        "type": "string"\n    }\n}\n\n\n\nTOOL: discreteNumericResponse\n            OBJECTIF: \n        Répondre avec une valeur <NUMERIC> appropriée lorsque aucune des réponses possibles n’a de sens à appliquer.\n\n            FORMAT JSON: {\n    "type": "object",\n    "properties": {\n        "request": {\n            "default": "discreteNumericResponse",\n            "type": "string"\n        },\n        "NUMERIC": {\n            "type": "integer"\n        }\n    },\n    "required": [\n        "NUMERIC",\n        "request"\n    ],\n    "request": {\n        "enum": [\n            "discreteNumericResponse"\n        ],\n        "type": "string"\n    }\n}\n\n\n\nLorsqu’un des OUTILS ci-dessus est applicable, vous devez exprimer votre \ndemande par "TOOL :" suivi de la requête dans le format ci-dessus.\n'
 
+def build_agents(
+        config_folder:str,
+        n: int,
+        source: str,
+        subsample: int | None = None,
+        population_sample: pd.DataFrame | None = None,
+        response_cache: ResponseCache | None = None,
+        llm_config: lm.OpenAIGPTConfig | None = None,
+        endpoint_pool: EndpointPool | None = None,
+        **kwargs) -> Tuple[AgentFactory, pd.DataFrame]:
+    model_config, synth_conf, _, _ = load_config(config_folder)
+    if population_sample is None:
+        population_sample = synthesize_population(config_folder=config_folder, n_sample=subsample, source=source, min_age=18, max_age=65)
+
+    assert isinstance(population_sample, pd.DataFrame)
+
+    if source == "US":
+        person = load_pums_data(config_folder=config_folder)
+        ploc = puma_locations(config_folder)
     if source == "FR":
-        for agent in agents:
-            agent.system_tool_instructions = fr_system_tool_instructions
-            agent.system_tool_format_instructions = fr_system_tool_format_instructions
+        person = load_insee_census(config_folder=config_folder)
+        ploc = None
+
+    MsgGen = SystemMessageGenerator(config_folder, "SystemMessage.j2", **kwargs)
+
+    if llm_config is None:
+        llm_config, endpoint_pool = build_llm(model_config)
+
+    agents = AgentFactory(
+        population_sample,
+        MsgGen,
+        person,
+        ploc,
+        source,
+        synth_conf,
+        llm_config,
+        subsample=subsample,
+        response_cache=response_cache,
+        endpoint_pool=endpoint_pool)
 
     return agents, population_sample
 
@@ -0,0 +1,53 @@
+import json
+import time
+import urllib.request
+import langroid.language_models as lm
+from endpoints import EndpointPool, _Endpoint
+from mockllm import MockLLMServer
+
+
+def _chat(pool: EndpointPool):
+    """
+    One request routed like SurveyAgent._routed_llm_response, returns the endpoint that answered
+    """
+    for _ in range(len(pool)):
+        endpoint = pool.acquire()
+        request = urllib.request.Request(
+            endpoint.api_base.rstrip("/") + "/chat/completions",
+            data=json.dumps({"messages": [{"role": "user", "content": "hello"}]}).encode("utf-8"),
+            headers={"Content-Type": "application/json"})
+        try:
+            urllib.request.urlopen(request, timeout=2).close()
+        except OSError:
+            pool.release(endpoint, None, ok=False)
+            continue
+        pool.release(endpoint, 0.01)
+        return endpoint
+    raise RuntimeError("no endpoint answered")
+
+
+def test_ollama_endpoint_probes_resolved_base_url():
+    endpoint = _Endpoint(lm.OpenAIGPTConfig(chat_model="ollama/llama3.2:latest"))
+    assert endpoint.models_url == "http://localhost:11434/v1/models"
+
+
+def test_failover_and_recovery():
+    servers = [MockLLMServer().start() for _ in range(2)]
+    pool = EndpointPool([lm.OpenAIGPTConfig(chat_model=server.chat_model) for server in servers], retry_after=0.2, probe_timeout=0.5)
+    down, up = pool.endpoints
+    try:
+        # requests to a killed endpoint are rerouted and it leaves the rotation
+        down_port = servers[0]._httpd.server_address[1]
+        servers[0].stop()
+        assert {_chat(pool) for _ in range(4)} == {up}
+        assert not down.healthy
+        assert pool.stats()[down.name]["errors"] == 1
+
+        # back up, it passes its health check after retry_after and takes requests again
+        servers[0] = MockLLMServer(port=down_port).start()
+        time.sleep(0.3)
+        assert _chat(pool) is down
+        assert down.healthy
+    finally:
+        for server in servers:
+            server.stop()
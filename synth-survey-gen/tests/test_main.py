@@ -0,0 +1,86 @@
+import threading
+from queue import Queue
+import pandas as pd
+from survey import AgentResponsePackage
+from journal import RunJournal, BioStore
+from postprocess import ProcessSurveyResponse
+from synthesize import AgentFactory
+from main import postprocess_response
+
+DATE_STR = "20240101_0000"
+N_AGENTS = 5
+
+
+def _package(i: int) -> AgentResponsePackage:
+    return AgentResponsePackage(
+        agent_id=f"Agent_{i}",
+        agent_bio=f"bio {i}",
+        serial_number=str(100 + i),
+        logic_flow=["TRAVEL"],
+        parsed_responses=[i],
+        responses_scraps=[None],
+        encoded_responses=[i],
+        tool_dtypes=["TEXT"],
+        dtype_matches=[True],
+        n_questions=1,
+        bad_iteration=False)
+
+
+def _factory() -> AgentFactory:
+    factory = AgentFactory.__new__(AgentFactory)
+    factory.individual_attributes = [{} for _ in range(N_AGENTS)]
+    factory.serial_numbers = [str(100 + i) for i in range(N_AGENTS)]
+    factory.completed = set()
+    return factory
+
+
+def _run(tmp_path, agents, fail_serialize=()):
+    """
+    One run of main's postprocessing thread: returns its journal and postprocessor, left open
+    """
+    postprocessor = ProcessSurveyResponse(str(tmp_path), batch_size=2, RUN_FOLDER=str(tmp_path), source="US", date_str=DATE_STR)
+    journal = RunJournal(str(tmp_path), DATE_STR, bio_store=BioStore(str(tmp_path), DATE_STR))
+    for result in journal.replay():
+        postprocessor.serialize_response(result)
+
+    if fail_serialize:
+        serialize_response = postprocessor.serialize_response
+        def flaky_serialize(result):
+            if result.agent_id in fail_serialize:
+                raise OSError("disk full")
+            serialize_response(result)
+        postprocessor.serialize_response = flaky_serialize
+
+    result_queue, stop_event = Queue(), threading.Event()
+    for i in agents:
+        result_queue.put(_package(i))
+    stop_event.set()
+    postprocess_response(result_queue, stop_event, postprocessor, journal, DATE_STR)
+    return journal, postprocessor
+
+
+def test_killed_run_resumes_without_duplicates(tmp_path):
+    (tmp_path / "data").mkdir()
+    pd.DataFrame(columns=["SAMPNO", "TRAVEL"]).to_csv(tmp_path / "data" / "person.csv", index=False)
+
+    # first run is killed after three agents, one of them failing to postprocess,
+    # and leaves a partial record behind
+    journal, _ = _run(tmp_path, agents=[0, 1, 2], fail_serialize={"Agent_1"})
+    journal._file.flush()
+    with open(journal.path, "a") as f:
+        f.write('{"agent_id": "Agent_3", "serial')
+
+    # resume surveys only the agents missing from the journal
+    factory = _factory()
+    factory.skip(RunJournal(str(tmp_path), DATE_STR).completed())
+    pending = [i for i, _, _ in factory._pending()]
+    assert pending == [3, 4]
+
+    journal, postprocessor = _run(tmp_path, agents=pending)
+    journal.close()
+    assert postprocessor.write_results(str(tmp_path), DATE_STR, results_log=journal.path) is True
+
+    results = pd.read_csv(tmp_path / f"{DATE_STR}_results.csv")
+    assert sorted(results["agent_id"]) == [f"Agent_{i}" for i in range(N_AGENTS)]
+    assert not results["agent_id"].duplicated().any()
+    assert sorted(r["agent_id"] for r in journal.replay(raw=True)) == [f"Agent_{i}" for i in range(N_AGENTS)]
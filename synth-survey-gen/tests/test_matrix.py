@@ -0,0 +1,60 @@
+import pandas as pd
+from survey import AgentResponsePackage
+from matrix import ResponseMatrix
+from postprocess import ProcessSurveyResponse, ResultsWriter
+
+
+SURVEY_VARS = ["DTYPE", "TRAVEL", "WRKHRS"]
+
+# mixed answers: lists and a single int on the multiple choice DTYPE, a list on the single
+# answer TRAVEL, text and an empty answer on WRKHRS, and an agent that stopped early
+ANSWERS = [
+    {"DTYPE": [1, 2], "TRAVEL": [3, 4], "WRKHRS": "about 40 hours"},
+    {"DTYPE": 5, "TRAVEL": 2, "WRKHRS": None},
+    {"DTYPE": [6]},
+]
+
+
+def _packages():
+    return [
+        AgentResponsePackage(
+            agent_id=f"Agent_{i}",
+            agent_bio=f"bio {i}",
+            serial_number=str(100 + i),
+            logic_flow=list(answers),
+            parsed_responses=list(answers.values()),
+            responses_scraps=[None] * len(answers),
+            encoded_responses=list(answers.values()),
+            tool_dtypes=["TEXT"] * len(answers),
+            dtype_matches=[True] * len(answers),
+            n_questions=len(answers),
+            bad_iteration=False)
+        for i, answers in enumerate(ANSWERS)]
+
+
+def _clean(test_dataset: pd.DataFrame) -> pd.DataFrame:
+    writer = ResultsWriter.__new__(ResultsWriter)
+    writer.survey_conf = {"logic": {var: None for var in SURVEY_VARS}}
+    writer.analysis_conf = {"multiple_choice": ["DTYPE"], "exclude": []}
+    writer.test_dataset = test_dataset
+    writer._clean_test_datasets()
+    return writer.test_dataset
+
+
+def test_matrix_frame_matches_csv_results(tmp_path):
+    (tmp_path / "data").mkdir()
+    pd.DataFrame(columns=["SAMPNO", *SURVEY_VARS]).to_csv(tmp_path / "data" / "person.csv", index=False)
+
+    writer = ProcessSurveyResponse(str(tmp_path), batch_size=2, RUN_FOLDER=str(tmp_path), source="US", date_str="run")
+    for package in _packages():
+        writer.serialize_response(package)
+    assert writer.write_results(str(tmp_path), "run") is True
+
+    csv_frame = _clean(pd.read_csv(tmp_path / "run_results.csv"))
+    matrix_frame = _clean(ResponseMatrix().extend(_packages()).to_frame(multiple_choice=["DTYPE"]))
+
+    for col in ["travel", "wrkhrs"]:
+        pd.testing.assert_series_equal(matrix_frame[col], csv_frame[col])
+    assert matrix_frame["travel"].tolist() == [3, 2, pd.NA]
+    assert matrix_frame["dtype"].tolist() == [[1, 2], [5], [6]]
+    assert matrix_frame["dtype"].map(str).tolist() == csv_frame["dtype"].tolist()
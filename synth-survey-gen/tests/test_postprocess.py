@@ -0,0 +1,67 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from survey import AgentResponsePackage
+from postprocess import ProcessSurveyResponse, read_chunk
+
+
+def _package(i: int, answers: dict) -> AgentResponsePackage:
+    return AgentResponsePackage(
+        agent_id=f"Agent_{i}",
+        agent_bio=f"bio {i}",
+        serial_number=str(100 + i),
+        logic_flow=list(answers),
+        parsed_responses=list(answers.values()),
+        responses_scraps=[None] * len(answers),
+        encoded_responses=list(answers.values()),
+        tool_dtypes=["TEXT"] * len(answers),
+        dtype_matches=[True] * len(answers),
+        n_questions=len(answers),
+        bad_iteration=False)
+
+
+@pytest.fixture
+def postprocessor(tmp_path):
+    (tmp_path / "data").mkdir()
+    pd.DataFrame(columns=["SAMPNO", "DTYPE", "TRAVEL"]).to_csv(tmp_path / "data" / "person.csv", index=False)
+    return ProcessSurveyResponse(str(tmp_path), batch_size=2, RUN_FOLDER=str(tmp_path), source="US", date_str="run")
+
+
+def test_chunks_are_typed(postprocessor):
+    postprocessor.serialize_response(_package(0, {"DTYPE": [1, 2], "TRAVEL": 3}))
+    postprocessor.serialize_response(_package(1, {"DTYPE": 4, "TRAVEL": "about 5 trips"}))
+
+    chunk_path, = postprocessor.chunk_paths
+    schema = pq.read_schema(chunk_path)
+    assert schema.field("agent_id").type == pa.string()
+    assert schema.field("dtype").type == pa.list_(pa.int64())
+    assert schema.field("travel").type == pa.int64()
+    assert schema.field("travel__text").type == pa.string()
+
+    chunk = read_chunk(chunk_path)
+    assert chunk["dtype"].tolist() == [[1, 2], [4]]
+    assert chunk["travel"].tolist() == [3, "about 5 trips"]
+
+
+def test_failed_flush_keeps_rows(postprocessor, tmp_path, monkeypatch):
+    def disk_full(*args, **kwargs):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as m:
+        m.setattr(pq, "write_table", disk_full)
+        postprocessor.serialize_response(_package(0, {"TRAVEL": 1}))
+        with pytest.raises(OSError):
+            postprocessor.serialize_response(_package(1, {"TRAVEL": 2}))
+    assert postprocessor.buffer_rows == 2
+    assert postprocessor.chunk_paths == []
+
+    assert postprocessor.write_results(str(tmp_path), "run") is True
+    results = pd.read_csv(tmp_path / "run_results.csv")
+    assert results["agent_id"].tolist() == ["Agent_0", "Agent_1"]
+    assert results["travel"].tolist() == [1, 2]
+
+
+def test_buffer_counts_list_answers(postprocessor):
+    postprocessor.serialize_response(_package(0, {"DTYPE": list(range(100))}))
+    assert postprocessor.buffer_bytes >= 100 * 8
@@ -0,0 +1,43 @@
+import asyncio
+from types import SimpleNamespace
+from langroid.language_models import LLMMessage, Role
+from survey import SurveyEngine
+
+
+SURVEY_CONF = {"start": "SLOW", "logic": {"SLOW": "FAST", "FAST": None}}
+QUESTIONS = {
+    "SLOW": {"question": "slow question", "dtype": "TEXT", "response": {}},
+    "FAST": {"question": "fast question", "dtype": "TEXT", "response": {}},
+}
+
+
+class _FakeAgent:
+    """
+    Logs the user prompt before awaiting the LLM like langroid does, the SLOW question never returns
+    """
+    def __init__(self):
+        self.config = SimpleNamespace(name="Agent_0")
+        self.bio = "bio"
+        self.serial_number = "1"
+        self.message_history = [LLMMessage(role=Role.SYSTEM, content="system")]
+        self.queued_variable = None
+
+    def queue_question(self, variable, question_package, shuffle_response=False):
+        self.queued_variable = variable
+
+    async def ask_question_async(self):
+        self.message_history.append(LLMMessage(role=Role.USER, content=self.queued_variable))
+        if self.queued_variable == "SLOW":
+            await asyncio.sleep(60)
+        self.message_history.append(LLMMessage(role=Role.ASSISTANT, content="answer"))
+
+
+def test_timed_out_question_leaves_no_unanswered_prompt():
+    agent = _FakeAgent()
+    engine = SurveyEngine(SURVEY_CONF, QUESTIONS, [agent], shuffle_response=False, question_timeout=0.05)
+    engine.run()
+
+    package = engine.results()[0]
+    assert package.tool_dtypes == ["TIMEOUT", "TEXT"]
+    assert [m.role for m in agent.message_history] == [Role.SYSTEM, Role.USER, Role.ASSISTANT]
+    assert agent.message_history[1].content == "FAST"
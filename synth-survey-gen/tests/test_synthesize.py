@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+from synthesize import _fillna_categorical
+
+
+def test_fillna_categorical_mixed_frame():
+    df = pd.DataFrame({
+        "SEX": pd.Categorical(["1", "2", "1"]),
+        "SCHL": pd.Categorical(["16", None, "21"]),
+        "SERIALNO": ["a", None, "c"],
+        "AGEP": [30, 40, 50]})
+
+    filled = _fillna_categorical(df, "MISSING")
+
+    assert filled["SEX"].tolist() == ["1", "2", "1"]
+    assert "MISSING" not in filled["SEX"].cat.categories
+    assert isinstance(filled["SCHL"].dtype, pd.CategoricalDtype)
+    assert filled["SCHL"].tolist() == ["16", "MISSING", "21"]
+    assert filled["SERIALNO"].tolist() == ["a", "MISSING", "c"]
+    assert filled["AGEP"].dtype == np.int64
+    assert not filled.isna().any().any()
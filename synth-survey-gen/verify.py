@@ -6,7 +6,8 @@ from tqdm import tqdm
 from pathlib import Path
 import pandas as pd
 from pandas import DataFrame
-from preprocess import generate_questions
+from preprocess import load_questions
+from journal import read_results_log, load_bios, bios_path
 from ollama import chat
 
 global evaluator_prompt
@@ -82,15 +83,25 @@ Now, evaluate the following survey responses:
 
 """
 
-def read_results_json(run_path: str):
+def read_results_json(run_path: str, with_bios: bool = False):
+    """
+    Streams agent results of a run one record at a time from the line-delimited
+    results log, falling back to the results.json of older runs. agent_bio is
+    only joined back from the run's bio table when with_bios is set.
+    """
     folder_path = Path(run_path)
     folder_name = folder_path.name
 
     run_date = folder_name.split("_", 1)[1]
+    results_logs = list(folder_path.glob(run_date+"_results.jsonl*"))
+    if results_logs:
+        bios = load_bios(bios_path(folder_path, run_date)) if with_bios else None
+        yield from read_results_log(results_logs[0], bios=bios)
+        return
+
     results_json = list(folder_path.glob(run_date+"_results.json"))[0]
     with open(results_json, "r") as f:
-        results_json = json.load(f)
-    return results_json
+        yield from json.load(f)
 
 
 def _remove_substrings(text, remove_list):
@@ -229,7 +240,7 @@ def main():
 
     # get results and survey questions
     run_results = read_results_json(RESULT_FOLDER)
-    questions = generate_questions(CONFIG_FOLDER)
+    questions = load_questions(CONFIG_FOLDER)
 
     remove_list = [
         "TOOL: ",